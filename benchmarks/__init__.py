@@ -0,0 +1,14 @@
+"""
+Package: benchmarks
+Performance benchmarks of the shopcarts service
+"""
+import subprocess
+
+
+def git_commit():
+    """Returns the commit the benchmark ran on, None outside of a git checkout"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
@@ -0,0 +1,380 @@
+"""
+Load Generator
+
+Replays a weighted mix of the API calls of features/shopcart.feature against
+a running service and reports the throughput and the p50/p95/p99 latency of
+every endpoint as JSON. The operations of the mix are:
+
+  create_cart:  POST   /api/shopcarts
+  read_cart:    GET    /api/shopcarts/<user_id>
+  list_carts:   GET    /api/shopcarts
+  add_item:     POST   /api/shopcarts/<user_id>/items
+  list_range:   GET    /api/shopcarts/<user_id>/items?max-price=5&min-price=3
+  list_order:   GET    /api/shopcarts/<user_id>/items?order-type=PA (or PD, TA, TD)
+  update_item:  PUT    /api/shopcarts/<user_id>/items/<product_id>
+  delete_item:  DELETE /api/shopcarts/<user_id>/items/<product_id>
+  replace:      PUT    /api/shopcarts/<user_id>
+  empty:        PUT    /api/shopcarts/<user_id>/empty
+  delete_cart:  DELETE /api/shopcarts/<user_id>
+
+Every virtual user is a thread with its own keep-alive connection and its
+own shopcarts, seeded like the Background of the feature file, so the calls
+of one user never fail because of another. An operation that needs a
+shopcart or a product the user does not have creates it instead.
+
+The service is started with gunicorn (--server gunicorn --workers 4), as in
+production, or with the Flask development server (--server flask), on a
+temporary SQLite database, or on the database of BENCHMARK_DATABASE_URI.
+DATABASE_URI is never used, so the load does not fill the database of the
+service. SQLite serializes the writes, so measure the capacity of a pod
+against Postgres. --url sends the
+load to a service that is already running instead.
+
+Usage: python -m benchmarks.load [--server gunicorn|flask] [--workers 4] [--url http://localhost:8080]
+                                 [--users 16] [--duration 30] [--warmup 5]
+                                 [--mix read_cart=20,add_item=20,...] [--output results.json]
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+from benchmarks import git_commit
+
+DEFAULT_MIX = {
+    "create_cart": 4,
+    "read_cart": 20,
+    "list_carts": 3,
+    "add_item": 20,
+    "list_range": 15,
+    "list_order": 15,
+    "update_item": 8,
+    "delete_item": 5,
+    "replace": 4,
+    "empty": 3,
+    "delete_cart": 3,
+}
+
+# the Background of features/shopcart.feature
+BACKGROUND_PRODUCTS = [
+    {"product_id": "3", "name": "pen", "quantity": 1, "price": 2, "time": "2019-11-18"},
+    {"product_id": "4", "name": "food", "quantity": 2, "price": 4, "time": "2019-11-18"},
+    {"product_id": "5", "name": "water", "quantity": 3, "price": 6, "time": "2019-11-18"},
+]
+NAMES = ["pen", "food", "water", "test", "book", "cup"]
+ORDER_TYPES = ["PA", "PD", "TA", "TD"]
+
+
+def parse_mix(text):
+    """Parses name=weight pairs separated by commas"""
+    mix = {}
+    for pair in text.split(","):
+        name, _, weight = pair.partition("=")
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown operation {name}, use one of {', '.join(DEFAULT_MIX)}")
+        try:
+            mix[name] = float(weight)
+        except ValueError as error:
+            raise argparse.ArgumentTypeError(f"the weight of {name} is not a number") from error
+    if not any(weight > 0 for weight in mix.values()):
+        raise argparse.ArgumentTypeError("at least one weight must be positive")
+    return mix
+
+
+def percentile(latencies, percent):
+    """Returns the nearest-rank percentile of sorted latencies"""
+    if not latencies:
+        return None
+    return latencies[max(0, math.ceil(percent / 100 * len(latencies)) - 1)]
+
+
+class Recorder:
+    """Collects the latency and status of every measured call"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, operation, status, seconds):
+        """Records one call, any status of 400 or more or a failed connection is an error"""
+        with self._lock:
+            self.latencies.setdefault(operation, []).append(seconds)
+            if status == 0 or status >= 400:
+                self.errors[operation] = self.errors.get(operation, 0) + 1
+
+    def summary(self, elapsed):
+        """Returns the throughput and the latency percentiles of every operation and of all of them"""
+        def stats(latencies, errors):
+            latencies = sorted(latencies)
+            return {
+                "requests": len(latencies),
+                "errors": errors,
+                "throughput_rps": round(len(latencies) / elapsed, 2),
+                "p50_ms": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+                "p95_ms": round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+                "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+                "max_ms": round(latencies[-1] * 1000, 2) if latencies else None,
+            }
+
+        with self._lock:
+            endpoints = {
+                operation: stats(latencies, self.errors.get(operation, 0))
+                for operation, latencies in sorted(self.latencies.items())
+            }
+            everything = [seconds for latencies in self.latencies.values() for seconds in latencies]
+            total = stats(everything, sum(self.errors.values()))
+        return total, endpoints
+
+
+class VirtualUser:
+    """One client replaying the mix on its own shopcarts"""
+
+    def __init__(self, url, api_key, mix, prefix, seed):
+        parts = urlsplit(url)
+        self.connection = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+        self.headers = {"Content-Type": "application/json", "X-Api-Key": api_key}
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.prefix = prefix
+        self.random = random.Random(seed)
+        self.carts = {}  # user_id: set of product_ids
+        self._ids = 0
+
+    def next_id(self):
+        """Returns an id no other virtual user uses"""
+        self._ids += 1
+        return f"{self.prefix}-{self._ids}"
+
+    def request(self, method, path, body=None):
+        """Sends one request and returns its status, 0 when the connection failed"""
+        payload = json.dumps(body) if body is not None else None
+        try:
+            self.connection.request(method, path, body=payload, headers=self.headers)
+            response = self.connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            return 0
+
+    def product(self, user_id, product_id):
+        """Returns a product like the ones of the feature file"""
+        return {
+            "user_id": user_id,
+            "product_id": product_id,
+            "name": self.random.choice(NAMES),
+            "quantity": self.random.randint(1, 5),
+            "price": self.random.randint(1, 10),
+            "time": "2022-11-29",
+        }
+
+    def seed(self, carts):
+        """Creates shopcarts holding the products of the Background, untimed"""
+        for _ in range(carts):
+            user_id = self.next_id()
+            self.request("POST", "/api/shopcarts", {"user_id": user_id})
+            for product in BACKGROUND_PRODUCTS:
+                self.request("POST", f"/api/shopcarts/{user_id}/items", dict(product, user_id=user_id))
+            self.carts[user_id] = {product["product_id"] for product in BACKGROUND_PRODUCTS}
+
+    def plan(self, operation):
+        """Returns the operation that can run now and its request, and updates the shopcarts"""
+        if operation == "create_cart" or not self.carts:
+            user_id = self.next_id()
+            self.carts[user_id] = set()
+            return "create_cart", ("POST", "/api/shopcarts", {"user_id": user_id})
+        user_id = self.random.choice(sorted(self.carts))
+        products = self.carts[user_id]
+        base = f"/api/shopcarts/{user_id}"
+        if operation in ("update_item", "delete_item") and not products:
+            operation = "add_item"
+        if operation == "read_cart":
+            return operation, ("GET", base, None)
+        if operation == "list_carts":
+            return operation, ("GET", "/api/shopcarts", None)
+        if operation == "add_item":
+            product_id = self.next_id()
+            products.add(product_id)
+            return operation, ("POST", f"{base}/items", self.product(user_id, product_id))
+        if operation == "list_range":
+            return operation, ("GET", f"{base}/items?max-price=5&min-price=3", None)
+        if operation == "list_order":
+            return operation, ("GET", f"{base}/items?order-type={self.random.choice(ORDER_TYPES)}", None)
+        if operation == "update_item":
+            product_id = self.random.choice(sorted(products))
+            return operation, ("PUT", f"{base}/items/{product_id}", self.product(user_id, product_id))
+        if operation == "delete_item":
+            product_id = self.random.choice(sorted(products))
+            products.discard(product_id)
+            return operation, ("DELETE", f"{base}/items/{product_id}", None)
+        if operation == "replace":
+            replacement = [dict(product, user_id=user_id) for product in BACKGROUND_PRODUCTS]
+            self.carts[user_id] = {product["product_id"] for product in replacement}
+            return operation, ("PUT", base, replacement)
+        if operation == "empty":
+            products.clear()
+            return operation, ("PUT", f"{base}/empty", None)
+        # delete_cart
+        del self.carts[user_id]
+        return operation, ("DELETE", base, None)
+
+    def run(self, recorder, measure_from, stop_at):
+        """Replays the mix until stop_at, recording the calls made after measure_from"""
+        while time.monotonic() < stop_at:
+            operation = self.random.choices(self.operations, self.weights)[0]
+            operation, (method, path, body) = self.plan(operation)
+            started = time.perf_counter()
+            status = self.request(method, path, body)
+            seconds = time.perf_counter() - started
+            if time.monotonic() >= measure_from:
+                recorder.record(operation, status, seconds)
+        self.connection.close()
+
+
+def free_port():
+    """Returns a TCP port nothing listens on"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_up(url, process, timeout):
+    """Waits for GET /health to answer, raises RuntimeError when the server does not start"""
+    parts = urlsplit(url)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"the server exited with code {process.returncode}")
+        connection = http.client.HTTPConnection(parts.hostname, parts.port, timeout=1)
+        try:
+            connection.request("GET", "/health")
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        finally:
+            connection.close()
+        time.sleep(0.2)
+    raise RuntimeError(f"the server did not answer within {timeout} seconds")
+
+
+def start_server(kind, workers, log):
+    """Starts the service on a free port, returns its process, URL and API key"""
+    port = free_port()
+    api_key = secrets.token_hex(16)
+    env = dict(os.environ, FLASK_APP="service:app", API_KEY=api_key)
+    # the load leaves shopcarts behind, so DATABASE_URI is never inherited
+    if os.getenv("BENCHMARK_DATABASE_URI"):
+        env["DATABASE_URI"] = os.environ["BENCHMARK_DATABASE_URI"]
+    else:
+        env["DATABASE_URI"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "load.db")
+        # made once here, so that the workers do not race to create the tables
+        subprocess.run([sys.executable, "-m", "flask", "create-db"], env=env, stdout=log, stderr=subprocess.STDOUT,
+                       check=True)
+    if kind == "gunicorn":
+        command = ["gunicorn", "--bind", f"127.0.0.1:{port}", "--workers", str(workers), "--log-level", "warning",
+                   "service:app"]
+    else:
+        command = [sys.executable, "-m", "flask", "run", "--host", "127.0.0.1", "--port", str(port),
+                   "--with-threads", "--no-reload", "--no-debugger"]
+    process = subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT)  # pylint: disable=consider-using-with
+    return process, f"http://127.0.0.1:{port}", api_key
+
+
+def stop_server(process):
+    """Stops the service"""
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def run(url, api_key, mix, users, duration, warmup, carts_per_user):
+    """Replays the mix with users virtual users, returns the recorder and the measured seconds"""
+    prefix = f"load-{secrets.token_hex(3)}"
+    virtual_users = [VirtualUser(url, api_key, mix, f"{prefix}-{i}", seed=i) for i in range(users)]
+    seeders = [threading.Thread(target=user.seed, args=(carts_per_user,)) for user in virtual_users]
+    for thread in seeders:
+        thread.start()
+    for thread in seeders:
+        thread.join()
+
+    recorder = Recorder()
+    measure_from = time.monotonic() + warmup
+    stop_at = measure_from + duration
+    threads = [threading.Thread(target=user.run, args=(recorder, measure_from, stop_at)) for user in virtual_users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, duration
+
+
+def main(argv=None):
+    """Starts the service, replays the mix and prints or writes the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--server", choices=["gunicorn", "flask"], default="gunicorn")
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    parser.add_argument("--url", help="a running service to load instead of starting one")
+    parser.add_argument("--api-key", default=os.getenv("API_KEY", ""), help="API key of the --url service")
+    parser.add_argument("--users", type=int, default=16, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="seconds measured")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds of load before measuring")
+    parser.add_argument("--carts-per-user", type=int, default=2, help="shopcarts seeded per virtual user")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="operation=weight pairs")
+    parser.add_argument("--output", help="file to write the results to instead of printing them")
+    args = parser.parse_args(argv)
+
+    process = None
+    log = tempfile.NamedTemporaryFile("w", prefix="load-server-", suffix=".log", delete=False)
+    try:
+        if args.url:
+            url, api_key = args.url.rstrip("/"), args.api_key
+        else:
+            try:
+                process, url, api_key = start_server(args.server, args.workers, log)
+                wait_until_up(url, process, timeout=60)
+            except (OSError, RuntimeError, subprocess.CalledProcessError) as error:
+                sys.exit(f"Cannot start the {args.server} server: {error}, see {log.name}")
+        recorder, elapsed = run(url, api_key, args.mix, args.users, args.duration, args.warmup,
+                                args.carts_per_user)
+    finally:
+        if process is not None:
+            stop_server(process)
+        log.close()
+
+    total, endpoints = recorder.summary(elapsed)
+    report = {
+        "benchmark": "load",
+        "commit": git_commit(),
+        "target": args.url or f"{args.server}" + (f" ({args.workers} workers)" if args.server == "gunicorn" else ""),
+        "users": args.users,
+        "duration_s": args.duration,
+        "mix": args.mix,
+        "total": total,
+        "endpoints": endpoints,
+        "server_log": None if args.url else log.name,
+    }
+    body = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            output.write(body + "\n")
+    else:
+        print(body)
+
+
+if __name__ == "__main__":
+    main()
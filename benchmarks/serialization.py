@@ -0,0 +1,91 @@
+"""
+Serialization Benchmark
+
+Compares the two ways a list of shopcarts becomes a response body:
+
+  marshal: serialize(), walked again by the flask-restx marshaller, encoded with json
+  fast:    serialize(), checked against the model and encoded with orjson
+
+Usage: python -m benchmarks.serialization [--carts 10 100 1000] [--products 10] [--repeat 5]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from datetime import date
+
+# the service connects to the database and creates its tables on import,
+# so it gets an in-memory one, never the DATABASE_URI of the service
+os.environ["DATABASE_URI"] = "sqlite://"
+
+from service import app  # noqa: E402 pylint: disable=wrong-import-position
+from service.models import Products, Shopcarts  # noqa: E402 pylint: disable=wrong-import-position
+from service.routes import api, conforms, id_shopcart_model  # noqa: E402 pylint: disable=wrong-import-position
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def make_shopcarts(carts, products):
+    """Builds shopcarts with products in memory, without a database"""
+    shopcarts = []
+    for cart in range(carts):
+        user_id = str(cart)
+        shopcart = Shopcarts(id=cart + 1, user_id=user_id, item_count=products,
+                             total_quantity=float(products), subtotal=2.0 * products)
+        shopcart.products = [
+            Products(id=cart * products + i + 1, user_id=user_id, product_id=str(i), name=f"Product {i}",
+                     quantity=1.0, price=2.0, time=date(2022, 1, 1))
+            for i in range(products)
+        ]
+        shopcarts.append(shopcart)
+    return shopcarts
+
+
+def marshal_path(shopcarts):
+    """The body as every endpoint built it before the fast path"""
+    return json.dumps(api.marshal([shopcart.serialize() for shopcart in shopcarts], id_shopcart_model))
+
+
+def fast_path(shopcarts):
+    """The body as the list endpoints build it now"""
+    data = [shopcart.serialize() for shopcart in shopcarts]
+    if not conforms(data, id_shopcart_model.resolved.keys()):
+        raise AssertionError("serialize() does not match the model")
+    return orjson.dumps(data)
+
+
+def run(carts_sizes, products, repeat):
+    """Times both paths for every number of carts, in milliseconds per body"""
+    results = []
+    with app.test_request_context():
+        for carts in carts_sizes:
+            shopcarts = make_shopcarts(carts, products)
+            number = max(1, 1000 // carts)
+            row = {"carts": carts, "products_per_cart": products}
+            for name, path in (("marshal_ms", marshal_path), ("fast_ms", fast_path)):
+                best = min(timeit.repeat(lambda: path(shopcarts), number=number, repeat=repeat))
+                row[name] = round(best / number * 1000, 3)
+            row["speedup"] = round(row["marshal_ms"] / row["fast_ms"], 2)
+            results.append(row)
+    return results
+
+
+def main(argv=None):
+    """Runs the benchmark and prints the results as JSON"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--carts", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--products", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+    if orjson is None:
+        sys.exit("orjson is not installed")
+    print(json.dumps({"benchmark": "serialization", "results": run(args.carts, args.products, args.repeat)},
+                     indent=2))
+
+
+if __name__ == "__main__":
+    main()
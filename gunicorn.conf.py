@@ -0,0 +1,27 @@
+"""
+Gunicorn Configuration
+
+Gunicorn loads this file from the working directory. When
+PROMETHEUS_MULTIPROC_DIR is set, the metrics files of the previous run are
+removed at start up and those of dead workers are marked, so that /metrics
+only adds up the workers that are alive.
+"""
+import glob
+import os
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+
+def on_starting(_server):
+    """Removes the metrics files left by the previous run"""
+    if MULTIPROC_DIR:
+        os.makedirs(MULTIPROC_DIR, exist_ok=True)
+        for path in glob.glob(os.path.join(MULTIPROC_DIR, "*.db")):
+            os.remove(path)
+
+
+def child_exit(_server, worker):
+    """Drops the live gauges of a worker that exited"""
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+        multiprocess.mark_process_dead(worker.pid)
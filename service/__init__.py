@@ -10,6 +10,10 @@ import logging
 from flask import Flask
 from flask_restx import Api
 from service.common import log_handlers  # noqa: F401, E402
+from service.common import pool_stats
+from service.common.compression import init_compression
+from service.common.representations import output_json
+from service.common.request_timing import init_request_timing
 from service import config
 
 # Create Flask application
@@ -43,6 +47,7 @@ api = Api(app,
           doc='/apidocs/',  # default also could use doc='/apidocs/'
           authorizations=authorizations,
           prefix='/api')
+api.representation('application/json')(output_json)
 # Dependencies require we import the routes AFTER the Flask app is created
 # pylint: disable=wrong-import-position, wrong-import-order
 from service import routes       # noqa: E402, E261
@@ -53,11 +58,15 @@ from .models import Products, Shopcarts
 # Set up logging for production
 log_handlers.init_logging(app, "gunicorn.error")
 
+init_compression(app)
+init_request_timing(app)
+
 app.logger.info(70 * "*")
 app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
 app.logger.info(70 * "*")
 
 try:
+    pool_stats.init_pool_stats(app)
     Products.init_db(app)  # make our SQLAlchemy tables
     Shopcarts.init_db(app)
 # pylint: disable=broad-except
@@ -0,0 +1,173 @@
+"""
+Cart Cache
+
+This module contains the read-through cache that sits in front of the
+shopcart and item read paths. Entries are grouped in one namespace per
+shopcart so that a write can invalidate everything cached for that cart.
+
+The default backend is an in-process LRU cache. Each gunicorn worker has
+its own copy and only sees its own invalidations, so CACHE_TTL bounds how
+stale a read served by another worker can be.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class CartCache:
+    """Interface of the cart cache backends"""
+
+    def get(self, namespace, key):
+        """Returns the cached value or None if it is missing"""
+        raise NotImplementedError
+
+    def set(self, namespace, key, value, generation=None):
+        """Caches a value, unless the namespace was invalidated since generation"""
+        raise NotImplementedError
+
+    def generation(self, namespace):
+        """Returns a token that changes every time the namespace is invalidated"""
+        raise NotImplementedError
+
+    def invalidate(self, namespace):
+        """Removes every value cached in the namespace"""
+        raise NotImplementedError
+
+    def clear(self):
+        """Removes every cached value"""
+        raise NotImplementedError
+
+    def stats(self):
+        """Returns the counters of the cache"""
+        raise NotImplementedError
+
+    def get_or_load(self, namespace, key, loader):
+        """Returns the cached value, calling loader to fill the cache on a miss
+
+        Values loaded while the namespace is being invalidated are not
+        cached, and None is never cached
+        """
+        value = self.get(namespace, key)
+        if value is not None:
+            return value
+        generation = self.generation(namespace)
+        value = loader()
+        if value is not None:
+            self.set(namespace, key, value, generation)
+        return value
+
+
+class NullCache(CartCache):
+    """Cache that stores nothing, used when caching is turned off"""
+
+    def __init__(self):
+        self.misses = 0
+
+    def get(self, namespace, key):
+        self.misses += 1
+
+    def set(self, namespace, key, value, generation=None):
+        pass
+
+    def generation(self, namespace):
+        return 0
+
+    def invalidate(self, namespace):
+        pass
+
+    def clear(self):
+        pass
+
+    def stats(self):
+        return {"type": "none", "hits": 0, "misses": self.misses, "evictions": 0,
+                "expirations": 0, "size": 0, "max_size": 0}
+
+
+class LRUCache(CartCache):
+    """In-process cache that drops the least recently used values when full
+    and values older than ttl seconds
+    """
+
+    def __init__(self, max_size=1024, ttl=5.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (namespace, key) -> (expires_at, value)
+        self._namespaces = {}  # namespace -> set of keys
+        self._generations = {}  # namespace -> invalidation count
+
+    def get(self, namespace, key):
+        with self._lock:
+            entry = self._entries.get((namespace, key))
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                self._remove(namespace, key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end((namespace, key))
+            self.hits += 1
+            return value
+
+    def set(self, namespace, key, value, generation=None):
+        with self._lock:
+            if generation is not None and generation != self._generations.get(namespace, 0):
+                return
+            self._entries[(namespace, key)] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end((namespace, key))
+            self._namespaces.setdefault(namespace, set()).add(key)
+            while len(self._entries) > self.max_size:
+                (old_namespace, old_key), _ = self._entries.popitem(last=False)
+                self._forget(old_namespace, old_key)
+                self.evictions += 1
+
+    def generation(self, namespace):
+        with self._lock:
+            return self._generations.get(namespace, 0)
+
+    def invalidate(self, namespace):
+        with self._lock:
+            self._generations[namespace] = self._generations.get(namespace, 0) + 1
+            for key in self._namespaces.pop(namespace, ()):
+                self._entries.pop((namespace, key), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._namespaces.clear()
+            self._generations.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"type": "lru", "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                    "expirations": self.expirations, "size": len(self._entries), "max_size": self.max_size}
+
+    def _remove(self, namespace, key):
+        """Removes one entry, the lock must be held"""
+        del self._entries[(namespace, key)]
+        self._forget(namespace, key)
+
+    def _forget(self, namespace, key):
+        """Drops a key from its namespace, the lock must be held"""
+        keys = self._namespaces.get(namespace)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._namespaces[namespace]
+
+
+def init_cache(app):
+    """Creates the cart cache selected by the CACHE_TYPE setting"""
+    cache_type = app.config.get("CACHE_TYPE", "lru")
+    if cache_type == "lru":
+        return LRUCache(max_size=app.config["CACHE_MAX_SIZE"], ttl=app.config["CACHE_TTL"])
+    if cache_type == "none":
+        return NullCache()
+    raise ValueError(f"Unknown CACHE_TYPE {cache_type}")
@@ -1,8 +1,10 @@
 """
 Flask CLI Command Extensions
 """
+import click
+from sqlalchemy import inspect, literal, text
 from service import app
-from service.models import db
+from service.models import db, Shopcarts
 
 
 ######################################################################
@@ -18,3 +20,71 @@ def create_db():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to add missing indexes to existing tables
+# Usage: flask create-indexes
+######################################################################
+@app.cli.command("create-indexes")
+def create_indexes():
+    """
+    Creates the indexes declared on the models that are missing from the
+    database, without touching the data.
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+
+
+######################################################################
+# Command to add missing columns to existing tables
+# Usage: flask add-columns
+######################################################################
+@app.cli.command("add-columns")
+def add_columns():
+    """
+    Adds the columns declared on the models that are missing from the
+    existing tables, filled with their default value, without touching
+    the data.
+    """
+    inspector = inspect(db.engine)
+    dialect = db.engine.dialect
+    preparer = dialect.identifier_preparer
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = (f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN "
+                       f"{preparer.format_column(column)} {column.type.compile(dialect=dialect)}")
+                if column.default is not None and column.default.is_scalar:
+                    value = literal(column.default.arg, column.type).compile(
+                        dialect=dialect, compile_kwargs={"literal_binds": True}
+                    )
+                    ddl += f" DEFAULT {value}"
+                elif not column.nullable:
+                    raise click.ClickException(
+                        f"Cannot add {table.name}.{column.name}, it is NOT NULL without a default"
+                    )
+                if not column.nullable:
+                    ddl += " NOT NULL"
+                connection.execute(text(ddl))
+                click.echo(f"Added the column {table.name}.{column.name}")
+
+
+######################################################################
+# Command to repair the totals stored on the shopcarts
+# Usage: flask reconcile-carts
+######################################################################
+@app.cli.command("reconcile-carts")
+def reconcile_carts():
+    """
+    Recomputes the item count, total quantity and subtotal of every
+    shopcart from its products and repairs the ones that drifted.
+    """
+    repaired = Shopcarts.reconcile()
+    click.echo(f"Repaired the totals of {repaired} shopcarts")
@@ -0,0 +1,123 @@
+"""
+Response Compression
+
+This module compresses the responses with gzip, or with brotli when the
+brotli package is installed and the client prefers it, as negotiated by
+Accept-Encoding. Bodies smaller than COMPRESS_MIN_SIZE, media types that are
+not in COMPRESS_MIMETYPES and files sent straight from disk are left alone.
+Streamed responses are compressed chunk by chunk and flushed after every
+chunk, so each NDJSON line still reaches the client as soon as it is made.
+
+A strong ETag has to differ between the content codings of a resource, so
+the coding is appended to the ETag of a compressed response, e.g. "1-42-gzip".
+identity_etag takes it off again when a request sends the tag back.
+"""
+import zlib
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CODINGS = ("gzip", "br")
+
+
+class GzipCompressor:
+    """Incremental gzip compressor"""
+
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+    def compress(self, data):
+        """Compresses a chunk and flushes it"""
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        """Returns the end of the compressed stream"""
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliCompressor:
+    """Incremental brotli compressor"""
+
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        """Compresses a chunk and flushes it"""
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self):
+        """Returns the end of the compressed stream"""
+        return self._compressor.finish()
+
+
+def choose_encoding(accept_encodings):
+    """Returns the supported content coding the client prefers, or None"""
+    offered = ["br", "gzip"] if brotli is not None else ["gzip"]
+    return accept_encodings.best_match(offered)
+
+
+def identity_etag(etag):
+    """Returns the entity tag without the content coding a compressed response appended to it"""
+    for coding in CODINGS:
+        if etag.endswith(f"-{coding}"):
+            return etag[:-len(coding) - 1]
+    return etag
+
+
+def compress_stream(chunks, compressor):
+    """Yields the compressed chunks of a streamed body"""
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            if chunk:
+                yield compressor.compress(chunk)
+        yield compressor.finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def init_compression(app):
+    """Compresses the responses of the app"""
+    settings = app.config
+
+    def make_compressor(encoding):
+        if encoding == "br":
+            return BrotliCompressor(settings["COMPRESS_BR_QUALITY"])
+        return GzipCompressor(settings["COMPRESS_LEVEL"])
+
+    @app.after_request
+    def compress_response(response):  # pylint: disable=unused-variable
+        if not settings["COMPRESS_ENABLED"]:
+            return response
+        if (
+            response.status_code < 200
+            or response.status_code in (204, 304)
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in settings["COMPRESS_MIMETYPES"]
+        ):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = compress_stream(response.response, make_compressor(encoding))
+            response.headers.pop("Content-Length", None)
+        else:
+            body = response.get_data()
+            if len(body) < settings["COMPRESS_MIN_SIZE"]:
+                return response
+            compressor = make_compressor(encoding)
+            response.set_data(compressor.compress(body) + compressor.finish())
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(f"{etag}-{encoding}")
+        return response
@@ -18,7 +18,7 @@
 Module: error_handlers
 """
 from flask import jsonify
-from service.models import DataValidationError, DatabaseConnectionError
+from service.models import DataValidationError, DatabaseConnectionError, ProductConflictError, VersionConflictError
 from service import app, api
 from . import status
 
@@ -50,6 +50,30 @@ def database_connection_error(error):
     }, status.HTTP_503_SERVICE_UNAVAILABLE
 
 
+@api.errorhandler(VersionConflictError)
+def version_conflict_error(error):
+    """Handles writes that lost the race against another write"""
+    message = str(error)
+    app.logger.warning(message)
+    return {
+        'status_code': status.HTTP_412_PRECONDITION_FAILED,
+        'error': 'Precondition Failed',
+        'message': message
+    }, status.HTTP_412_PRECONDITION_FAILED
+
+
+@api.errorhandler(ProductConflictError)
+def product_conflict_error(error):
+    """Handles writes that would put a product twice in a shopcart"""
+    message = str(error)
+    app.logger.warning(message)
+    return {
+        'status_code': status.HTTP_409_CONFLICT,
+        'error': 'Conflict',
+        'message': message
+    }, status.HTTP_409_CONFLICT
+
+
 @app.errorhandler(status.HTTP_404_NOT_FOUND)
 def not_found(error):
     """Handles resources not found with 404_NOT_FOUND"""
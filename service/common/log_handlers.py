@@ -18,19 +18,90 @@
 Log Handlers
 
 This module contains utility functions to set up logging
-consistently
+consistently. The handlers run on a background thread behind a queue, so
+a request never waits for a log line to be written.
 """
+import atexit
+import json
 import logging
+import queue
+import random
+from logging.handlers import QueueHandler, QueueListener
+from flask import has_request_context, request
+
+SAMPLED_KEY = "shopcarts.log.sampled"
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as one JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "module": record.module,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry)
+
+
+class RequestSampler(logging.Filter):
+    """Keeps the INFO and DEBUG records of a sample of the requests
+
+    The decision is made once per request so that a sampled request keeps
+    all of its lines. Warnings, errors and records logged outside of a
+    request are always kept.
+    """
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if self.rate >= 1 or record.levelno >= logging.WARNING or not has_request_context():
+            return True
+        if SAMPLED_KEY not in request.environ:
+            request.environ[SAMPLED_KEY] = random.random() < self.rate
+        return request.environ[SAMPLED_KEY]
+
+
+def make_formatter(log_format):
+    """Returns the formatter of the "text" or "json" log format"""
+    if log_format == "json":
+        return JsonFormatter(datefmt="%Y-%m-%dT%H:%M:%S%z")
+    return logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z")
 
 
 def init_logging(app, logger_name: str):
-    """Set up logging for production"""
+    """Set up logging for production
+
+    Returns:
+        QueueListener: the thread writing the records, None without handlers
+    """
     app.logger.propagate = False
     gunicorn_logger = logging.getLogger(logger_name)
-    app.logger.handlers = gunicorn_logger.handlers
+    handlers = list(gunicorn_logger.handlers)
     app.logger.setLevel(gunicorn_logger.level)
     # Make all log formats consistent
-    formatter = logging.Formatter("[%(asctime)s] [%(levelname)s] [%(module)s] %(message)s", "%Y-%m-%d %H:%M:%S %z")
-    for handler in app.logger.handlers:
+    formatter = make_formatter(app.config.get("LOG_FORMAT", "text"))
+    for handler in handlers:
         handler.setFormatter(formatter)
+    if handlers:
+        # The app logger only puts the records on a queue, the gunicorn
+        # handlers write them out on the listener thread
+        records = queue.SimpleQueue()
+        queue_handler = QueueHandler(records)
+        queue_handler.addFilter(RequestSampler(app.config.get("LOG_SAMPLE_RATE", 1.0)))
+        listener = QueueListener(records, *handlers, respect_handler_level=True)
+        listener.start()
+        atexit.register(listener.stop)
+        app.logger.handlers = [queue_handler]
+    else:
+        listener = None
+        app.logger.handlers = []
     app.logger.info("Logging handler established")
+    return listener
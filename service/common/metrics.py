@@ -0,0 +1,158 @@
+"""
+Prometheus Metrics
+
+This module collects the request, database, connection pool and cache
+metrics served by GET /metrics.
+
+With several gunicorn workers, set PROMETHEUS_MULTIPROC_DIR to an empty
+directory before the workers start: every worker then writes its metrics
+to memory mapped files in it, and /metrics adds up the files of all of the
+workers, whichever worker answers the scrape. See gunicorn.conf.py.
+"""
+import os
+import time
+from flask import request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+from . import sql_timing
+from .pool_stats import pool_stats
+
+START_KEY = "shopcarts.metrics.start"
+# seconds between two refreshes of the pool and cache gauges of a process
+GAUGE_REFRESH_INTERVAL = 1.0
+
+REQUESTS = Counter(
+    "shopcarts_http_requests_total", "HTTP requests", ["method", "route", "status"]
+)
+REQUEST_LATENCY = Histogram(
+    "shopcarts_http_request_duration_seconds", "HTTP request latency", ["method", "route"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0),
+)
+IN_PROGRESS = Gauge(
+    "shopcarts_http_requests_in_progress", "HTTP requests being served", ["method", "route"],
+    multiprocess_mode="livesum",
+)
+DB_QUERIES = Counter(
+    "shopcarts_db_queries_total", "SQL statements sent to the database", ["operation"]
+)
+DB_QUERY_LATENCY = Histogram(
+    "shopcarts_db_query_duration_seconds", "SQL statement latency", ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+POOL_CHECKED_OUT = Gauge(
+    "shopcarts_db_pool_checked_out", "Database connections in use", multiprocess_mode="livesum"
+)
+POOL_EVENTS = Gauge(
+    "shopcarts_db_pool_events", "Connection pool events of the live workers since they started", ["event"],
+    multiprocess_mode="livesum",
+)
+POOL_WAIT = Gauge(
+    "shopcarts_db_pool_wait_seconds_total", "Time the live workers spent waiting for a connection",
+    multiprocess_mode="livesum",
+)
+POOL_WAIT_MAX = Gauge(
+    "shopcarts_db_pool_wait_seconds_max", "Longest wait of a live worker for a connection", multiprocess_mode="max"
+)
+CACHE_EVENTS = Gauge(
+    "shopcarts_cache_events", "Cart cache events of the live workers since they started", ["event"],
+    multiprocess_mode="livesum",
+)
+CACHE_SIZE = Gauge(
+    "shopcarts_cache_entries", "Entries in the cart caches", multiprocess_mode="livesum"
+)
+
+
+class Metrics:
+    """Records the metrics of a Flask app"""
+
+    def __init__(self, app, cache):
+        self.app = app
+        self.cache = cache
+        self._refreshed = 0.0
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+        sql_timing.add_observer(self.observe_query)
+        event.listen(Pool, "checkout", self.on_checkout)
+        event.listen(Pool, "checkin", self.on_checkin)
+
+    @staticmethod
+    def route():
+        """Returns the URL rule of the request, so that the labels do not grow with the ids"""
+        return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+    def before_request(self):
+        """Counts the request in progress"""
+        request.environ[START_KEY] = time.perf_counter()
+        IN_PROGRESS.labels(request.method, self.route()).inc()
+
+    def after_request(self, response):
+        """Counts the request and observes its latency"""
+        start = request.environ.get(START_KEY)
+        if start is not None:
+            route = self.route()
+            REQUESTS.labels(request.method, route, str(response.status_code)).inc()
+            REQUEST_LATENCY.labels(request.method, route).observe(time.perf_counter() - start)
+        self.refresh_gauges()
+        return response
+
+    def teardown_request(self, _error=None):
+        """Ends the request in progress, also when it failed"""
+        if request.environ.pop(START_KEY, None) is not None:
+            IN_PROGRESS.labels(request.method, self.route()).dec()
+
+    @staticmethod
+    def observe_query(statement, _parameters, duration, _context):
+        """Counts a SQL statement and observes its latency"""
+        operation = sql_timing.operation(statement)
+        DB_QUERIES.labels(operation).inc()
+        DB_QUERY_LATENCY.labels(operation).observe(duration)
+
+    @staticmethod
+    def on_checkout(_dbapi_connection, _record, _proxy):
+        """Counts a connection taken from a pool"""
+        POOL_CHECKED_OUT.inc()
+
+    @staticmethod
+    def on_checkin(_dbapi_connection, _record):
+        """Counts a connection returned to a pool"""
+        POOL_CHECKED_OUT.dec()
+
+    def refresh_gauges(self, force=False):
+        """Copies the pool and cache counters of this process to the gauges
+
+        The counters live in this process only, so each worker publishes its
+        own and the scrape adds them up. This is done at most once every
+        GAUGE_REFRESH_INTERVAL seconds.
+        """
+        now = time.monotonic()
+        if not force and now - self._refreshed < GAUGE_REFRESH_INTERVAL:
+            return
+        self._refreshed = now
+        pool = pool_stats.snapshot()
+        for name in ("checkouts", "timeouts", "connects", "invalidations"):
+            POOL_EVENTS.labels(name).set(pool[name])
+        POOL_WAIT.set(pool["wait_seconds_total"])
+        POOL_WAIT_MAX.set(pool["wait_seconds_max"])
+        cache = self.cache.stats()
+        for name in ("hits", "misses", "evictions", "expirations"):
+            CACHE_EVENTS.labels(name).set(cache[name])
+        CACHE_SIZE.set(cache["size"])
+
+    def render(self):
+        """Returns the body and content type of the metrics of every worker"""
+        self.refresh_gauges(force=True)
+        if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry = REGISTRY
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def init_metrics(app, cache):
+    """Starts recording the metrics of the app and of its cart cache"""
+    return Metrics(app, cache)
@@ -0,0 +1,113 @@
+"""
+Connection Pool Statistics
+
+This module contains a queue pool that records how many connections are
+checked out and how long requests wait to get one, so that pools can be
+sized against the number of gunicorn workers
+"""
+import threading
+import time
+import weakref
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+class PoolStats:
+    """Counters shared by every timed pool of the process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pools = weakref.WeakSet()
+        self.reset()
+
+    def reset(self):
+        """Sets every counter back to zero"""
+        with self._lock:
+            self.checkouts = 0
+            self.timeouts = 0
+            self.connects = 0
+            self.invalidations = 0
+            self.wait_total = 0.0
+            self.wait_max = 0.0
+
+    def record_checkout(self, wait):
+        """Records a connection handed out after waiting wait seconds"""
+        with self._lock:
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def record_timeout(self):
+        """Records a request that gave up waiting for a connection"""
+        with self._lock:
+            self.timeouts += 1
+
+    def record_connect(self):
+        """Records a new connection to the database"""
+        with self._lock:
+            self.connects += 1
+
+    def record_invalidation(self):
+        """Records a connection thrown away after an error"""
+        with self._lock:
+            self.invalidations += 1
+
+    def snapshot(self):
+        """Returns the counters and the current state of every pool"""
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "wait_seconds_total": self.wait_total,
+                "wait_seconds_max": self.wait_max,
+                "pools": [
+                    {
+                        "size": pool.size(),
+                        "checked_in": pool.checkedin(),
+                        "checked_out": pool.checkedout(),
+                        "overflow": pool.overflow(),
+                    }
+                    for pool in list(self.pools)
+                ],
+            }
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records its checkouts and the time spent waiting for them"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        pool_stats.pools.add(self)
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_stats.record_timeout()
+            raise
+        pool_stats.record_checkout(time.perf_counter() - start)
+        return connection
+
+
+@event.listens_for(TimedQueuePool, "connect")
+def _on_connect(_dbapi_connection, _connection_record):
+    pool_stats.record_connect()
+
+
+@event.listens_for(TimedQueuePool, "invalidate")
+def _on_invalidate(_dbapi_connection, _connection_record, _exception):
+    pool_stats.record_invalidation()
+
+
+def init_pool_stats(app):
+    """Makes the engine use a TimedQueuePool when it is configured with a queue pool"""
+    options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+    if "pool_size" in options:
+        options.setdefault("poolclass", TimedQueuePool)
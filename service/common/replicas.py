@@ -0,0 +1,60 @@
+"""
+Read Replica Routing
+
+This module contains the session that sends the queries of GET and HEAD
+requests to a read replica. The replicas are the SQLALCHEMY_BINDS whose key
+starts with "replica", picked round-robin once per request. Everything else
+goes to the primary: writes, reads of any other request or outside of a
+request, and every read that follows a write in the same request.
+"""
+import itertools
+from flask import has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+from sqlalchemy.sql import Delete, Insert, Select, Update
+
+READ_METHODS = ("GET", "HEAD")
+WROTE_KEY = "shopcarts.db.wrote"
+REPLICA_KEY = "shopcarts.db.replica"
+
+_next_replica = itertools.count()
+
+
+def replica_binds(app):
+    """Returns the bind keys of the read replicas"""
+    return sorted(key for key in app.config.get("SQLALCHEMY_BINDS") or {} if key.startswith("replica"))
+
+
+class RoutingSession(SignallingSession):
+    """Session that reads from a replica during GET and HEAD requests"""
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._reads_from_replica(clause):
+            environ = request.environ
+            if REPLICA_KEY not in environ:
+                binds = replica_binds(self.app)
+                environ[REPLICA_KEY] = binds[next(_next_replica) % len(binds)]
+            return get_state(self.app).db.get_engine(self.app, bind=environ[REPLICA_KEY])
+        return super().get_bind(mapper, clause)
+
+    def _reads_from_replica(self, clause):
+        """Checks whether the statement can be served by a replica"""
+        if not has_request_context():
+            return False
+        if self._flushing or isinstance(clause, (Insert, Update, Delete)):
+            # reads after this one must see the write
+            request.environ[WROTE_KEY] = True
+            return False
+        return (
+            isinstance(clause, Select)
+            and request.method in READ_METHODS
+            and not request.environ.get(WROTE_KEY)
+            and bool(replica_binds(self.app))
+        )
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy extension whose sessions route reads to the replicas"""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
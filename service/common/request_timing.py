@@ -0,0 +1,91 @@
+"""
+Request Timing
+
+This module counts the SQL statements of every request and the time spent
+in them. Both are sent back in a Server-Timing header, e.g.
+
+    Server-Timing: db;dur=3.1;desc="4 queries", app;dur=5.6
+
+and written to the access log. A view can declare with @query_budget how
+many statements it is allowed to issue: going over the budget logs a
+warning, or raises QueryBudgetExceeded when QUERY_BUDGET_STRICT is set or
+the app is testing, so that an N+1 query fails the tests.
+"""
+import time
+from functools import wraps
+from flask import has_request_context, request
+from . import sql_timing
+
+START_KEY = "shopcarts.timing.start"
+QUERIES_KEY = "shopcarts.timing.queries"
+DB_TIME_KEY = "shopcarts.timing.db"
+BUDGET_KEY = "shopcarts.timing.budget"
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Used when a request issues more SQL statements than its budget"""
+
+
+def query_budget(limit):
+    """Allows the decorated view at most limit SQL statements per request"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            request.environ[BUDGET_KEY] = limit
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def request_stats():
+    """Returns the number of statements and the database seconds of the request so far"""
+    return request.environ.get(QUERIES_KEY, 0), request.environ.get(DB_TIME_KEY, 0.0)
+
+
+def server_timing(queries, db_seconds, total_seconds):
+    """Returns the Server-Timing header value of a request"""
+    app_seconds = max(total_seconds - db_seconds, 0.0)
+    return f'db;dur={db_seconds * 1000:.1f};desc="{queries} queries", app;dur={app_seconds * 1000:.1f}'
+
+
+def observe_query(_statement, _parameters, duration, _context):
+    """Adds a SQL statement to the statements of the current request"""
+    if not has_request_context():
+        return
+    environ = request.environ
+    environ[QUERIES_KEY] = environ.get(QUERIES_KEY, 0) + 1
+    environ[DB_TIME_KEY] = environ.get(DB_TIME_KEY, 0.0) + duration
+
+
+def init_request_timing(app):
+    """Times the SQL statements of every request of the app"""
+
+    sql_timing.add_observer(observe_query)
+
+    @app.before_request
+    def start_timing():  # pylint: disable=unused-variable
+        environ = request.environ
+        environ[START_KEY] = time.perf_counter()
+        environ[QUERIES_KEY] = 0
+        environ[DB_TIME_KEY] = 0.0
+
+    @app.after_request
+    def report_timing(response):  # pylint: disable=unused-variable
+        start = request.environ.get(START_KEY)
+        if start is None:
+            return response
+        total = time.perf_counter() - start
+        queries, db_seconds = request_stats()
+        response.headers["Server-Timing"] = server_timing(queries, db_seconds, total)
+        app.logger.info(
+            "%s %s %s %d queries db=%.1fms total=%.1fms",
+            request.method, request.full_path.rstrip("?"), response.status_code,
+            queries, db_seconds * 1000, total * 1000,
+        )
+        budget = request.environ.get(BUDGET_KEY)
+        if budget is not None and queries > budget:
+            message = f"{request.method} {request.path} issued {queries} queries, its budget is {budget}"
+            if app.config.get("QUERY_BUDGET_STRICT") or app.testing:
+                raise QueryBudgetExceeded(message)
+            app.logger.warning(message)
+        return response
@@ -0,0 +1,166 @@
+"""
+Slow Query Log
+
+This module records the SQL statements that take longer than SLOW_QUERY_MS.
+Each record has the statement, its parameters with the values redacted, the
+service method that issued it, e.g. Products.find_product_with_order, and,
+with SLOW_QUERY_EXPLAIN, the plan of the database for it, whose constants
+are redacted too. The last SLOW_QUERY_LOG_SIZE records of the process are
+kept in memory and served by GET /admin/slow-queries.
+"""
+import collections
+import re
+import sys
+import threading
+import time
+from . import sql_timing
+
+# the model methods that return a query name themselves in this execution
+# option, since the query runs after they returned
+CALLER_OPTION = "caller"
+CALLER_PACKAGE = "service."
+IGNORED_PACKAGE = "service.common"
+SQLALCHEMY_ORM_PACKAGE = "sqlalchemy.orm."
+SAVEPOINT = "slow_query_explain"
+# the constants of a plan: quoted literals, and numbers compared with a column
+QUOTED_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMERIC_CONSTANT = re.compile(r"(?<=[=<>] )-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?")
+
+
+def redact(parameters):
+    """Replaces the parameter values by their type names, keeping NULLs"""
+    if isinstance(parameters, dict):
+        return {key: redact(value) for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [redact(value) for value in parameters]
+    if parameters is None:
+        return None
+    return f"<{type(parameters).__name__}>"
+
+
+def query_caller(context):
+    """Returns the model method named by the caller execution option of a statement"""
+    if context is None:
+        return None
+    return context.execution_options.get(CALLER_OPTION)
+
+
+def find_caller():
+    """Returns the innermost model or route method on the stack, e.g. Products.find_product_with_order
+
+    The products of a selectinload are loaded by SQLAlchemy while the rows
+    of the query that asked for them are read, so the context of that query
+    is on the stack and its caller option names the method for both.
+    """
+    frame = sys._getframe(1)  # pylint: disable=protected-access
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith(SQLALCHEMY_ORM_PACKAGE):
+            # the QueryContext of the ORM query whose rows are being loaded
+            query = getattr(frame.f_locals.get("context"), "query", None)
+            if hasattr(query, "get_execution_options"):
+                caller = query.get_execution_options().get(CALLER_OPTION)
+                if caller is not None:
+                    return caller
+        if module.startswith(CALLER_PACKAGE) and not module.startswith(IGNORED_PACKAGE):
+            name = frame.f_code.co_name
+            owner = frame.f_locals.get("cls") or frame.f_locals.get("self")
+            if owner is not None:
+                owner = owner if isinstance(owner, type) else type(owner)
+                return f"{owner.__name__}.{name}"
+            return f"{module}.{name}"
+        frame = frame.f_back
+    return None
+
+
+def redact_plan(plan):
+    """Replaces the constants a plan shows, e.g. 'u1'::text or = 5, by ?"""
+    plan = QUOTED_LITERAL.sub("'?'", plan)
+    return NUMERIC_CONSTANT.sub("?", plan)
+
+
+def explain(context, statement, parameters, logger=None):
+    """Returns the redacted plan of a SELECT statement, None when it cannot be explained
+
+    The EXPLAIN runs on a new cursor of the DBAPI connection, so it is not
+    seen by the engine events and cannot be recorded itself. Outside of
+    SQLite it runs in a savepoint, because a failed statement would abort
+    the transaction of the request.
+    """
+    if context is None or context.executemany or sql_timing.operation(statement) != "SELECT":
+        return None
+    sqlite = context.dialect.name == "sqlite"
+    prefix = "EXPLAIN QUERY PLAN " if sqlite else "EXPLAIN "
+    cursor = context.root_connection.connection.cursor()
+    try:
+        if not sqlite:
+            cursor.execute(f"SAVEPOINT {SAVEPOINT}")
+        try:
+            cursor.execute(prefix + statement, parameters)
+            plan = "\n".join(str(row[-1]) for row in cursor.fetchall())
+        except context.dialect.dbapi.Error as error:
+            if not sqlite:
+                cursor.execute(f"ROLLBACK TO SAVEPOINT {SAVEPOINT}")
+            if logger is not None:
+                logger.warning("Cannot explain the slow query: %s", error)
+            return None
+        if not sqlite:
+            cursor.execute(f"RELEASE SAVEPOINT {SAVEPOINT}")
+        return redact_plan(plan)
+    finally:
+        cursor.close()
+
+
+class SlowQueryLog:
+    """Bounded log of the slowest SQL statements of the process"""
+
+    def __init__(self, threshold_ms, size, with_plans=False, logger=None):
+        self.threshold_ms = threshold_ms
+        self.with_plans = with_plans
+        self.logger = logger
+        self._records = collections.deque(maxlen=size)
+        self._local = threading.local()
+
+    def observe(self, statement, parameters, duration, context):
+        """Records the statement when it was slower than the threshold"""
+        duration_ms = duration * 1000
+        if duration_ms < self.threshold_ms or getattr(self._local, "recording", False):
+            return
+        # a plan or a caller lookup that runs SQL must not record itself
+        self._local.recording = True
+        try:
+            record = {
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "duration_ms": round(duration_ms, 3),
+                "statement": statement,
+                "parameters": redact(parameters),
+                "caller": query_caller(context) or find_caller(),
+                "plan": explain(context, statement, parameters, self.logger) if self.with_plans else None,
+            }
+        finally:
+            self._local.recording = False
+        self._records.append(record)
+        if self.logger is not None:
+            self.logger.warning(
+                "Slow query of %.1fms in %s: %s", duration_ms, record["caller"], " ".join(statement.split())
+            )
+
+    def records(self):
+        """Returns the records, the latest first"""
+        return list(reversed(self._records))
+
+    def clear(self):
+        """Forgets every record"""
+        self._records.clear()
+
+
+def init_slow_queries(app):
+    """Starts recording the slow SQL statements of the app"""
+    log = SlowQueryLog(
+        app.config["SLOW_QUERY_MS"],
+        app.config["SLOW_QUERY_LOG_SIZE"],
+        with_plans=app.config["SLOW_QUERY_EXPLAIN"],
+        logger=app.logger,
+    )
+    sql_timing.add_observer(log.observe)
+    return log
@@ -0,0 +1,63 @@
+"""
+SQL Timing
+
+This module times every statement sent to the database and hands the
+statement and its duration to the registered observers, such as the
+metrics. The engine events are listened to once for every engine of the
+process, so each observer does not add its own pair of listeners.
+"""
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_observers = []
+_lock = threading.Lock()
+_listening = False
+
+START_KEY = "sql_timing_start"
+
+
+def add_observer(observer):
+    """Calls observer(statement, parameters, duration, context) after every statement
+
+    The duration is in seconds. The observer runs on the thread that issued
+    the statement, so it must be quick.
+    """
+    global _listening  # pylint: disable=global-statement
+    with _lock:
+        if observer not in _observers:
+            _observers.append(observer)
+        if not _listening:
+            event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+            _listening = True
+
+
+def remove_observer(observer):
+    """Stops calling observer"""
+    with _lock:
+        if observer in _observers:
+            _observers.remove(observer)
+
+
+def operation(statement):
+    """Returns the kind of a statement: SELECT, INSERT, UPDATE, DELETE or OTHER"""
+    keyword = statement.lstrip()[:6].upper()
+    if keyword in ("SELECT", "INSERT", "UPDATE", "DELETE"):
+        return keyword
+    return "OTHER"
+
+
+def _before_cursor_execute(_conn, _cursor, _statement, _parameters, context, _executemany):
+    if context is not None:
+        setattr(context, START_KEY, time.perf_counter())
+
+
+def _after_cursor_execute(_conn, _cursor, statement, parameters, context, _executemany):
+    start = getattr(context, START_KEY, None)
+    if start is None:
+        return
+    duration = time.perf_counter() - start
+    for observer in list(_observers):
+        observer(statement, parameters, duration, context)
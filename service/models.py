@@ -5,14 +5,20 @@ All of the models are stored in this module
 """
 import logging
 from datetime import date
-from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import and_, desc
+from sqlalchemy import and_, desc, func, inspect, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import make_transient_to_detached, selectinload
+from service.common.replicas import RoutingSQLAlchemy
 
 
 logger = logging.getLogger("flask.app")
 
 # Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+# GET requests read from the replicas in DATABASE_REPLICA_URIS if there are any
+db = RoutingSQLAlchemy()
+
+# float totals closer than this are the same amount summed in another order
+TOTALS_TOLERANCE = 0.005
 
 
 def init_db(app):
@@ -29,6 +35,14 @@ class DatabaseConnectionError(Exception):
     """Custom Exception when database connection fails"""
 
 
+class VersionConflictError(Exception):
+    """ Used when a Shopcart changed since the version a write expected """
+
+
+class ProductConflictError(Exception):
+    """ Used when a Shopcart already holds the product a write puts in it """
+
+
 class Shopcarts(db.Model):
     """
     Class that represents a Shopcart
@@ -37,7 +51,13 @@ class Shopcarts(db.Model):
     __tablename__ = "shopcarts"
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.String(63), nullable=False, unique=True)
-    products = db.relationship("Products", backref="products", lazy=True)
+    # bumped by every change to the Shopcart or its products
+    version = db.Column(db.Integer, nullable=False, default=1)
+    # totals of the products, kept up to date by every change to them
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    total_quantity = db.Column(db.Float, nullable=False, default=0)
+    subtotal = db.Column(db.Float, nullable=False, default=0)
+    products = db.relationship("Products", backref="products", lazy=True, passive_deletes=True)
 
     def __repr__(self):
         return f"<Shopcarts {self.user_id}>"
@@ -69,11 +89,10 @@ class Shopcarts(db.Model):
     def delete(self):
         """ Removes a Shopcart from the data store """
         logger.info("Deleting %s", self.user_id)
-        products_in_shopcart = self.products
-        for product in products_in_shopcart:
-            logger.info("Deleting %s", product.name)
-            db.session.delete(product)
-        db.session.delete(self)
+        # the products are removed with one statement instead of one per row,
+        # ON DELETE CASCADE covers carts deleted outside of this method
+        Products.query.filter(Products.user_id == self.user_id).delete()
+        Shopcarts.query.filter(Shopcarts.id == self.id).delete()
         db.session.commit()
 
     def serialize(self):
@@ -84,6 +103,9 @@ class Shopcarts(db.Model):
         return {
             "id": self.id,
             "user_id": self.user_id,
+            "item_count": self.item_count,
+            "total_quantity": self.total_quantity,
+            "subtotal": self.subtotal,
             "products": product_list
             }
 
@@ -111,15 +133,111 @@ class Shopcarts(db.Model):
             ) from error
         return self
 
+    def replace_products(self, products, expected=None):
+        """
+        Replaces the products of a Shopcart in a single transaction
+
+        Only the difference with the stored products is written: products
+        that are gone are deleted, changed ones are updated and new ones are
+        inserted, each with one bulk statement
+
+        Args:
+            products (list): the deserialized Products the Shopcart should hold
+            expected (list): (id, version) pairs the Shopcart must be at, see touch
+        """
+        logger.info("Replacing products of %s", self.user_id)
+        wanted = {}
+        products = list({product.product_id: product for product in products}.values())
+        for product in products:
+            wanted[product.product_id] = {
+                "user_id": self.user_id,
+                "product_id": product.product_id,
+                "name": product.name,
+                "quantity": product.quantity,
+                "price": product.price,
+                "time": product.time,
+            }
+        # lock the Shopcart before reading its products, so that a concurrent
+        # replace waits for this one instead of diffing against stale rows
+        Shopcarts.touch(self.user_id, expected, totals={
+            "item_count": len(products),
+            "total_quantity": sum(product.quantity for product in products),
+            "subtotal": sum(product.price * product.quantity for product in products),
+        })
+        stored = Products.query.with_entities(
+            Products.id, Products.product_id, Products.name,
+            Products.quantity, Products.price, Products.time
+        ).filter(Products.user_id == self.user_id).all()
+
+        removed_ids = []
+        changed = []
+        for row in stored:
+            values = wanted.pop(row.product_id, None)
+            if values is None:
+                removed_ids.append(row.id)
+            elif (row.name, row.quantity, row.price, row.time) != \
+                    (values["name"], values["quantity"], values["price"], values["time"]):
+                changed.append(dict(values, id=row.id))
+        added = list(wanted.values())
+
+        logger.info("Deleting %d, updating %d and adding %d products in %s",
+                    len(removed_ids), len(changed), len(added), self.user_id)
+        if removed_ids:
+            Products.query.filter(Products.id.in_(removed_ids)).delete(synchronize_session=False)
+        if changed:
+            db.session.bulk_update_mappings(Products, changed)
+        if added:
+            db.session.bulk_insert_mappings(Products, added)
+        db.session.commit()
+
+    def add_products(self, products):
+        """
+        Adds products to a Shopcart in a single transaction
+
+        Products already in the Shopcart are updated. The stored products are
+        read with one IN query and all of them are written with one multi-row
+        upsert. When a product_id is given more than once the last one wins.
+
+        Args:
+            products (list): the deserialized Products to add
+        Returns:
+            list: (Products, created) pairs in the given order, with their ids set
+        """
+        logger.info("Adding %d products to %s", len(products), self.user_id)
+        latest = {product.product_id: product for product in products}
+        Shopcarts.touch(self.user_id)
+        stored = dict(
+            (row.product_id, row) for row in db.session.query(
+                Products.product_id, Products.quantity, Products.price
+            ).filter(Products.user_id == self.user_id, Products.product_id.in_(latest))
+        )
+        rows = [{
+            "user_id": self.user_id,
+            "product_id": product.product_id,
+            "name": product.name,
+            "quantity": product.quantity,
+            "price": product.price,
+            "time": product.time or date.today(),
+        } for product in latest.values()]
+        ids = dict(zip(latest, Products.upsert(rows))) if rows else {}
+        totals = [0, 0, 0]
+        for product_id, product in latest.items():
+            change = Products.totals_change(stored.get(product_id), product)
+            totals = [total + delta for total, delta in zip(totals, change)]
+        Shopcarts.add_to_totals(self.user_id, *totals)
+        db.session.commit()
+        for product in products:
+            product.user_id = self.user_id
+            product.id = ids[product.product_id]
+        return [(product, product.product_id not in stored) for product in products]
+
     def empty(self):
         """
         Empty a Shopcart
         """
         logger.info("Emptying %s", self.user_id)
-        products_in_shopcart = self.products
-        for product in products_in_shopcart:
-            logger.info("Deleting %s", product.name)
-            db.session.delete(product)
+        Shopcarts.touch(self.user_id, totals={"item_count": 0, "total_quantity": 0, "subtotal": 0})
+        Products.query.filter(Products.user_id == self.user_id).delete()
         db.session.commit()
 
     @classmethod
@@ -128,6 +246,115 @@ class Shopcarts(db.Model):
         logger.info("Initializing database")
         cls.app = app
 
+    @classmethod
+    def touch(cls, user_id, expected=None, totals=None):
+        """Bumps the version of a Shopcart in the current transaction
+
+        With expected, this is a conditional UPDATE that only matches the
+        expected id and version, so a concurrent change is detected without
+        holding a lock across the request. The UPDATE also locks the Shopcart
+        row until the transaction ends, so its products can be read and their
+        totals adjusted without racing another writer.
+
+        Args:
+            user_id (string): the user_id of the Shopcart that changed
+            expected (list): (id, version) pairs of which one must match
+            totals (dict): new item_count, total_quantity and subtotal to store
+        Raises:
+            VersionConflictError: if the Shopcart is not at an expected version
+        """
+        logger.debug("Bumping version of %s", user_id)
+        query = cls.query.filter(cls.user_id == user_id)
+        if expected is not None:
+            query = query.filter(or_(False, *[
+                and_(cls.id == by_id, cls.version == version) for by_id, version in expected
+            ]))
+        values = {cls.version: cls.version + 1}
+        for name, value in (totals or {}).items():
+            values[getattr(cls, name)] = value
+        # check the version before flushing any other pending change
+        with db.session.no_autoflush:
+            updated = query.update(values, synchronize_session=False)
+        if expected is not None and updated == 0:
+            db.session.rollback()
+            raise VersionConflictError(f"Shopcart {user_id} was changed by another request")
+
+    @classmethod
+    def add_to_totals(cls, user_id, item_count=0, total_quantity=0, subtotal=0):
+        """Adds to the totals of a Shopcart in the current transaction
+
+        Args:
+            user_id (string): the user_id of the Shopcart whose products changed
+            item_count (int): the number of products added, negative if removed
+            total_quantity (float): the change of the sum of the quantities
+            subtotal (float): the change of the sum of price times quantity
+        """
+        if not (item_count or total_quantity or subtotal):
+            return
+        logger.debug("Adding %s items, %s quantity and %s to the totals of %s",
+                    item_count, total_quantity, subtotal, user_id)
+        cls.query.filter(cls.user_id == user_id).update({
+            cls.item_count: cls.item_count + item_count,
+            cls.total_quantity: cls.total_quantity + total_quantity,
+            cls.subtotal: cls.subtotal + subtotal,
+        }, synchronize_session=False)
+
+    @classmethod
+    def reconcile(cls):
+        """Recomputes the totals of every Shopcart from its products
+
+        A single UPDATE repairs the Shopcarts whose totals drifted and bumps
+        their version, the others are left alone
+
+        Returns:
+            int: the number of Shopcarts that were repaired
+        """
+        logger.info("Reconciling the totals of all Shopcarts")
+        owned = Products.user_id == cls.user_id
+        item_count = select(func.count(Products.id)).where(owned).scalar_subquery()
+        total_quantity = select(func.coalesce(func.sum(Products.quantity), 0)).where(owned).scalar_subquery()
+        subtotal = select(func.coalesce(func.sum(Products.price * Products.quantity), 0)).where(owned).scalar_subquery()
+        repaired = cls.query.filter(or_(
+            cls.item_count != item_count,
+            func.abs(cls.total_quantity - total_quantity) > TOTALS_TOLERANCE,
+            func.abs(cls.subtotal - subtotal) > TOTALS_TOLERANCE,
+        )).update({
+            cls.version: cls.version + 1,
+            cls.item_count: item_count,
+            cls.total_quantity: total_quantity,
+            cls.subtotal: subtotal,
+        }, synchronize_session=False)
+        db.session.commit()
+        logger.info("Repaired the totals of %d Shopcarts", repaired)
+        return repaired
+
+    @classmethod
+    def find_totals(cls, user_id):
+        """Returns the totals of a Shopcart without loading it or its products
+
+        Args:
+            user_id (string): the user_id of the Shopcart
+        Returns:
+            Row: with the item_count, total_quantity and subtotal, or None if
+            there is no such Shopcart
+        """
+        logger.debug("Processing totals lookup for %s ...", user_id)
+        return db.session.query(
+            cls.item_count, cls.total_quantity, cls.subtotal
+        ).filter(cls.user_id == user_id).first()
+
+    @classmethod
+    def find_version(cls, user_id):
+        """Returns the id and version of a Shopcart without loading it
+
+        Args:
+            user_id (string): the user_id of the Shopcart
+        Returns:
+            Row: with the id and version, or None if there is no such Shopcart
+        """
+        logger.debug("Processing version lookup for %s ...", user_id)
+        return db.session.query(cls.id, cls.version).filter(cls.user_id == user_id).first()
+
     @classmethod
     def find_by_user_id(cls, user_id):
         """Returns all Products with the given name
@@ -135,19 +362,80 @@ class Shopcarts(db.Model):
         Args:
             name (string): the name of the Products you want to match
         """
-        logger.info("Processing name query for %s ...", user_id)
-        return cls.query.filter(cls.user_id == user_id)
+        logger.debug("Processing name query for %s ...", user_id)
+        return cls.query.filter(cls.user_id == user_id).execution_options(caller="Shopcarts.find_by_user_id")
+
+    @classmethod
+    def find_by_user_id_with_products(cls, user_id):
+        """Returns the Shopcart with the given user_id and its products
+
+        The products are batch loaded with a single IN query instead of
+        one lazy SELECT per shopcart
+
+        Args:
+            user_id (string): the user_id of the Shopcart you want to match
+        """
+        logger.debug("Processing user_id query with products for %s ...", user_id)
+        return cls.find_by_user_id(user_id).options(selectinload(cls.products)).execution_options(
+            caller="Shopcarts.find_by_user_id_with_products"
+        )
+
+    @classmethod
+    def find_by_user_ids_with_products(cls, user_ids):
+        """Returns the Shopcarts of many users and their products
+
+        One IN query finds the Shopcarts and one more loads all of their products
+
+        Args:
+            user_ids (list): the user_ids of the Shopcarts you want to match
+        """
+        logger.debug("Processing user_id query with products for %d users ...", len(user_ids))
+        return cls.query.filter(cls.user_id.in_(user_ids)).options(selectinload(cls.products)).execution_options(
+            caller="Shopcarts.find_by_user_ids_with_products"
+        )
 
     @classmethod
     def all(cls):
-        """ Returns all of the Products in the database """
-        logger.info("Processing all Products")
+        """ Returns all of the Shopcarts in the database """
+        logger.debug("Processing all Shopcarts")
         return cls.query.all()
 
+    @classmethod
+    def page_with_products(cls, after_id, limit):
+        """Returns a page of Shopcarts ordered by id with their products
+
+        Args:
+            after_id (int): only Shopcarts with an id greater than this are returned
+            limit (int): the maximum number of Shopcarts to return
+        """
+        logger.debug("Processing page of %s Shopcarts after id %s ...", limit, after_id)
+        query = cls.query.options(selectinload(cls.products)).execution_options(
+            caller="Shopcarts.page_with_products"
+        )
+        if after_id is not None:
+            query = query.filter(cls.id > after_id)
+        return query.order_by(cls.id).limit(limit).all()
+
+    @classmethod
+    def stream_with_products(cls, user_id, batch_size):
+        """Returns a query that yields Shopcarts and their products in batches
+
+        Args:
+            user_id (string): only stream the Shopcart of this user if given
+            batch_size (int): the number of Shopcarts fetched per round trip
+        """
+        logger.debug("Processing Shopcart stream in batches of %s ...", batch_size)
+        query = cls.query.options(selectinload(cls.products)).execution_options(
+            caller="Shopcarts.stream_with_products"
+        )
+        if user_id:
+            query = query.filter(cls.user_id == user_id)
+        return query.order_by(cls.id).yield_per(batch_size)
+
     @classmethod
     def find(cls, by_id):
         """ Finds a Shopcart by it's ID """
-        logger.info("Processing lookup for id %s ...", by_id)
+        logger.debug("Processing lookup for id %s ...", by_id)
         return cls.query.get(by_id)
 
     @classmethod
@@ -158,7 +446,7 @@ class Shopcarts(db.Model):
         :return: an instance with the id, or 404_NOT_FOUND if not found
         :rtype: Shopcarts
         """
-        logger.info("Processing lookup or 404 for id %s ...", user_id)
+        logger.debug("Processing lookup or 404 for id %s ...", user_id)
         return cls.query.get_or_404(user_id)
 
 
@@ -168,8 +456,15 @@ class Products(db.Model):
     """
     # Table Schema
     __tablename__ = "products"
+    # The unique index also serves lookups on the user_id foreign key, the
+    # other two back the price range filter and the price and time orderings
+    __table_args__ = (
+        db.Index("ix_products_user_id_product_id", "user_id", "product_id", unique=True),
+        db.Index("ix_products_user_id_price", "user_id", "price"),
+        db.Index("ix_products_user_id_time", "user_id", "time"),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.String(63), db.ForeignKey("shopcarts.user_id"), nullable=False)
+    user_id = db.Column(db.String(63), db.ForeignKey("shopcarts.user_id", ondelete="CASCADE"), nullable=False)
     product_id = db.Column(db.String(63), nullable=False)
     name = db.Column(db.String(63), nullable=False)
     quantity = db.Column(db.Float, nullable=False)
@@ -181,32 +476,88 @@ class Products(db.Model):
 
     def create(self):
         """
-        Creates a Products to the database
+        Creates a Products to the database, or updates the Products with the
+        same user_id and product_id if there is one already
         """
-        products = self.find_by_user_id_product_id(self.user_id, self.product_id)
-        if len(products.all()) > 0:
-            logger.info("Saving %s", self.name)
-            self.id = products.all()[0].id  # pylint: disable=invalid-name
-            db.session.commit()
-        else:
-            logger.info("Creating %s", self.name)
-            self.id = None  # id must be none to generate next primary key
-            db.session.add(self)
-            db.session.commit()
+        logger.info("Saving %s", self.name)
+        Shopcarts.touch(self.user_id)
+        with db.session.no_autoflush:
+            stored = self.stored_values(self.user_id, Products.product_id == self.product_id)
+        values = {
+            "user_id": self.user_id,
+            "product_id": self.product_id,
+            "name": self.name,
+            "quantity": self.quantity,
+            "price": self.price,
+            "time": self.time or date.today(),
+        }
+        self.id = self.upsert([values])[0]  # pylint: disable=invalid-name
+        Shopcarts.add_to_totals(self.user_id, *self.totals_change(stored, self))
+        state = inspect(self)
+        if state.transient:
+            make_transient_to_detached(self)
+            existing = db.session.identity_map.get(state.key)
+            if existing is None:
+                db.session.add(self)
+            else:
+                db.session.expire(existing)
+        db.session.commit()
 
-    def update(self):
+    def update(self, expected=None):
         """
         Updates a Products to the database
+
+        Args:
+            expected (list): (id, version) pairs the Shopcart the product was
+                in must be at, see Shopcarts.touch
+        Raises:
+            ProductConflictError: if the Shopcart the product ends up in
+                already has another product with its product_id
         """
-        logger.info("Saving %s", self.name)
-        if not self.id:
-            raise DataValidationError("Update called with empty ID field")
+        # the stored values must be read before the change is flushed
+        with db.session.no_autoflush:
+            logger.info("Saving %s", self.name)
+            if not self.id:
+                raise DataValidationError("Update called with empty ID field")
+            # the product may have been moved out of another shopcart
+            history = inspect(self).attrs.user_id.history
+            if history.deleted or history.unchanged:
+                original_user_id = (history.deleted or history.unchanged)[0]
+            else:  # expired before the change, look the stored user_id up
+                original_user_id = db.session.query(Products.user_id).filter(
+                    Products.id == self.id
+                ).scalar() or self.user_id
+            Shopcarts.touch(original_user_id, expected)
+            if self.user_id != original_user_id or inspect(self).attrs.product_id.history.has_changes():
+                # a Shopcart holds each product_id once
+                taken = db.session.query(Products.id).filter(
+                    Products.user_id == self.user_id,
+                    Products.product_id == self.product_id,
+                    Products.id != self.id,
+                ).first()
+                if taken is not None:
+                    db.session.rollback()
+                    raise ProductConflictError(
+                        f"Shopcart {self.user_id} already has a product with id {self.product_id}"
+                    )
+            if self.user_id != original_user_id:
+                Shopcarts.touch(self.user_id)
+            stored = self.stored_values(original_user_id, Products.id == self.id)
+        if self.user_id != original_user_id:
+            Shopcarts.add_to_totals(original_user_id, *self.totals_change(stored, None))
+            Shopcarts.add_to_totals(self.user_id, *self.totals_change(None, self))
+        else:
+            Shopcarts.add_to_totals(self.user_id, *self.totals_change(stored, self))
         db.session.commit()
 
     def delete(self):
         """ Removes a Products from the data store """
-        logger.info("Deleting %s", self.name)
+        with db.session.no_autoflush:
+            logger.info("Deleting %s", self.name)
+            Shopcarts.touch(self.user_id)
+            stored = self.stored_values(self.user_id, Products.id == self.id)
         db.session.delete(self)
+        Shopcarts.add_to_totals(self.user_id, *self.totals_change(stored, None))
         db.session.commit()
 
     def serialize(self):
@@ -253,6 +604,64 @@ class Products(db.Model):
 
         return self
 
+    @classmethod
+    def serialize_rows(cls, query):
+        """Serializes the Products selected by a query without loading them
+
+        Only the serialized columns are selected and each row is turned into
+        a dictionary directly, with the same output as serialize() but
+        without building and tracking a Products instance per row
+
+        Args:
+            query: a query of Products, e.g. from find_by_user_id
+        Returns:
+            generator: the serialized Products
+        """
+        rows = query.with_entities(
+            cls.id, cls.user_id, cls.product_id, cls.name, cls.quantity, cls.price, cls.time
+        )
+        for row in rows:
+            yield {
+                "id": row.id,
+                "user_id": row.user_id,
+                "product_id": row.product_id,
+                "name": row.name,
+                "quantity": row.quantity,
+                "price": row.price,
+                "time": row.time.isoformat()
+            }
+
+    @classmethod
+    def stored_values(cls, user_id, criterion):
+        """Returns the stored quantity and price of a product in a shopcart
+
+        Args:
+            user_id (string): the user_id of the shopcart
+            criterion: selects the product within the shopcart
+        Returns:
+            Row: with the quantity and price, or None if it is not stored
+        """
+        return db.session.query(cls.quantity, cls.price).filter(cls.user_id == user_id, criterion).first()
+
+    @staticmethod
+    def totals_change(old, new):
+        """Returns how the shopcart totals change when a product is replaced
+
+        Args:
+            old: the quantity and price before, None if the product is added
+            new: the quantity and price after, None if the product is removed
+        Returns:
+            tuple: the change of the item_count, total_quantity and subtotal
+        """
+        item_count, total_quantity, subtotal = 0, 0, 0
+        if old is not None:
+            item_count, total_quantity, subtotal = -1, -old.quantity, -old.price * old.quantity
+        if new is not None:
+            item_count += 1
+            total_quantity += new.quantity
+            subtotal += new.price * new.quantity
+        return item_count, total_quantity, subtotal
+
     @classmethod
     def init_db(cls, app):
         """ Initializes the database session """
@@ -263,16 +672,61 @@ class Products(db.Model):
         app.app_context().push()
         db.create_all()  # make our sqlalchemy tables
 
+    @classmethod
+    def upsert(cls, rows):
+        """Inserts the rows, updating the Products that already exist
+
+        This is a single INSERT ... ON CONFLICT (user_id, product_id) DO UPDATE
+        statement. It runs in the current transaction and does not commit.
+
+        Args:
+            rows (list): dictionaries with the column values of each Products
+        Returns:
+            list: the ids of the rows, in the same order
+        """
+        dialect = db.engine.dialect.name
+        if dialect == "postgresql":
+            statement = postgresql.insert(cls.__table__)
+        elif dialect == "sqlite":
+            statement = sqlite.insert(cls.__table__)
+        else:
+            raise DatabaseConnectionError(f"Upsert is not supported on {dialect}")
+        statement = statement.values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[cls.user_id, cls.product_id],
+            set_={
+                "name": statement.excluded.name,
+                "quantity": statement.excluded.quantity,
+                "price": statement.excluded.price,
+                "time": statement.excluded.time,
+            },
+        )
+        if dialect == "postgresql":
+            ids = dict(
+                ((row.user_id, row.product_id), row.id)
+                for row in db.session.execute(statement.returning(cls.id, cls.user_id, cls.product_id))
+            )
+        else:
+            # SQLite has no RETURNING before SQLAlchemy 2.0, read the ids back
+            db.session.execute(statement)
+            keys = [(row["user_id"], row["product_id"]) for row in rows]
+            found = db.session.query(cls.id, cls.user_id, cls.product_id).filter(
+                cls.user_id.in_({user_id for user_id, _ in keys}),
+                cls.product_id.in_({product_id for _, product_id in keys}),
+            )
+            ids = dict(((row.user_id, row.product_id), row.id) for row in found)
+        return [ids[(row["user_id"], row["product_id"])] for row in rows]
+
     @classmethod
     def all(cls):
         """ Returns all of the Products in the database """
-        logger.info("Processing all Products")
+        logger.debug("Processing all Products")
         return cls.query.all()
 
     @classmethod
     def find(cls, by_id):
         """ Finds a Products by it's ID """
-        logger.info("Processing lookup for id %s ...", by_id)
+        logger.debug("Processing lookup for id %s ...", by_id)
         return cls.query.get(by_id)
 
     @classmethod
@@ -282,8 +736,8 @@ class Products(db.Model):
         Args:
             name (string): the name of the Products you want to match
         """
-        logger.info("Processing name query for %s ...", name)
-        return cls.query.filter(cls.name == name)
+        logger.debug("Processing name query for %s ...", name)
+        return cls.query.filter(cls.name == name).execution_options(caller="Products.find_by_name")
 
     @classmethod
     def find_by_user_id_product_id(cls, user_id, product_id):
@@ -292,14 +746,14 @@ class Products(db.Model):
         Args:
             name (string): the name of the Products you want to match
         """
-        logger.info("Processing user_id and product_id query for %s and %s ...",
+        logger.debug("Processing user_id and product_id query for %s and %s ...",
                     user_id, product_id)
         return cls.query.filter(
             and_(
                 cls.user_id == user_id,
                 cls.product_id == product_id
             )
-        )
+        ).execution_options(caller="Products.find_by_user_id_product_id")
 
     @classmethod
     def find_or_404(cls, product_id):
@@ -309,7 +763,7 @@ class Products(db.Model):
         :return: an instance with the product_id, or 404_NOT_FOUND if not found
         :rtype: Products
         """
-        logger.info("Processing lookup or 404 for id %s ...", product_id)
+        logger.debug("Processing lookup or 404 for id %s ...", product_id)
         return cls.query.get_or_404(product_id)
 
     @classmethod
@@ -319,8 +773,8 @@ class Products(db.Model):
         Args:
             user_id (string): the user_id of the Products you want to match
         """
-        logger.info("Processing user_id query for %s ...", user_id)
-        return cls.query.filter(cls.user_id == user_id)
+        logger.debug("Processing user_id query for %s ...", user_id)
+        return cls.query.filter(cls.user_id == user_id).execution_options(caller="Products.find_by_user_id")
 
     @classmethod
     def find_product_with_range(cls, user_id, max_price, min_price):
@@ -330,12 +784,12 @@ class Products(db.Model):
             max_price (float): the highest price you want to query
             min_price (float): the lowest price you want to query
         """
-        query_info = f"user id: {user_id}"
-        query_info += f"max price: {max_price} "
-        query_info += f"min price: {min_price}"
-        logger.info("Processing product query for %s ...", query_info)
+        logger.debug("Processing product query for user id: %s max price: %s min price: %s ...",
+                     user_id, max_price, min_price)
         return cls.query.filter(and_(cls.user_id == user_id,
-                                cls.price <= max_price, cls.price >= min_price))
+                                cls.price <= max_price, cls.price >= min_price)).execution_options(
+            caller="Products.find_product_with_range"
+        )
 
     @classmethod
     def find_product_with_order(cls, user_id, order_type):
@@ -343,25 +797,25 @@ class Products(db.Model):
         Args:
             order_type (str): the order type you want to query
         """
-        query_info = f"user id: {user_id}"
-        query_info += f"order type: {order_type}"
-        logger.info("Processing product query for %s ...", query_info)
+        logger.debug("Processing product query for user id: %s order type: %s ...", user_id, order_type)
+        query = cls.query.filter(cls.user_id == user_id).execution_options(caller="Products.find_product_with_order")
         if order_type == "PA":
-            return cls.query.filter(cls.user_id == user_id).order_by(cls.price)
+            return query.order_by(cls.price)
         elif order_type == "PD":
-            return cls.query.filter(cls.user_id == user_id).order_by(desc(cls.price))
+            return query.order_by(desc(cls.price))
         elif order_type == "TA":
-            return cls.query.filter(cls.user_id == user_id).order_by(cls.time)
+            return query.order_by(cls.time)
         elif order_type == "TD":
-            return cls.query.filter(cls.user_id == user_id).order_by(desc(cls.time))
+            return query.order_by(desc(cls.time))
         else:
-            return cls.query.filter(cls.user_id == user_id)
+            return query.order_by(cls.id)
 
     @classmethod
     def find_product(cls, user_id):
         """Returns all Products with the given query parameter
 
         """
-        query_info = f"user id: {user_id}"
-        logger.info("Processing product query for %s ...", query_info)
-        return cls.query.filter(and_(cls.user_id == user_id))
+        logger.debug("Processing product query for user id: %s ...", user_id)
+        return cls.query.filter(and_(cls.user_id == user_id)).order_by(cls.id).execution_options(
+            caller="Products.find_product"
+        )
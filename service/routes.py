@@ -4,15 +4,36 @@ My Service
 Describe what your service does here
 """
 # pylint: disable=cyclic-import
+import base64
+import binascii
 import secrets
 from functools import wraps
-from flask import jsonify, request, abort
+from flask import Response, after_this_request, jsonify, request, abort, stream_with_context
 from flask_restx import fields, reqparse, Resource
-from service.models import Products, Shopcarts
+from flask_restx.utils import merge
+from werkzeug.http import quote_etag
+from service.models import DataValidationError, Products, Shopcarts
 from .common import status  # HTTP Status Codes
+from .common.cache import init_cache
+from .common.compression import identity_etag
+from .common.metrics import init_metrics
+from .common.request_timing import query_budget
+from .common.slow_queries import init_slow_queries
+from .common.pool_stats import pool_stats
+from .common.representations import json_line
 # Import Flask application
 from . import app, api
 
+NDJSON = "application/x-ndjson"
+
+# Read-through cache of the cart and item reads, one namespace per user_id
+cart_cache = init_cache(app)
+
+# Request, database, pool and cache metrics served by /metrics
+metrics = init_metrics(app, cart_cache)
+
+# Statements slower than SLOW_QUERY_MS, served by /admin/slow-queries
+slow_queries = init_slow_queries(app)
 
 ############################################################
 # Health Endpoint
@@ -23,6 +44,25 @@ def health():
     return jsonify(dict(status="OK")), status.HTTP_200_OK
 
 
+@app.route("/health/cache")
+def cache_stats():
+    """Hit, miss and eviction counters of the cart cache"""
+    return jsonify(cart_cache.stats()), status.HTTP_200_OK
+
+
+@app.route("/health/pool")
+def connection_pool_stats():
+    """Checkout, wait and usage statistics of the database connection pools"""
+    return jsonify(pool_stats.snapshot()), status.HTTP_200_OK
+
+
+@app.route("/metrics")
+def prometheus_metrics():
+    """Metrics of every worker in the Prometheus text format"""
+    body, content_type = metrics.render()
+    return Response(body, status=status.HTTP_200_OK, content_type=content_type)
+
+
 ######################################################################
 # Configure the Root route before OpenAPI
 ######################################################################
@@ -62,10 +102,25 @@ id_shopcart_model = api.inherit(
     shopcart_model,
     {
         'id': fields.Integer(readOnly=True, description='The unique id assigned internally by service'),
+        'item_count': fields.Integer(readOnly=True, description='The number of products in the shopcart'),
+        'total_quantity': fields.Float(readOnly=True, description='The sum of the quantities of the products'),
+        'subtotal': fields.Float(readOnly=True, description='The sum of price times quantity of the products'),
         'products': fields.List(cls_or_instance=product_field, required=False, description='The products it have')
     }
 )
 
+batch_result_model = api.model('BatchResult', {
+    'status': fields.String(readOnly=True, description='created or updated'),
+    'product': fields.Nested(record_model, readOnly=True, description='The stored product'),
+})
+
+summary_model = api.model('Summary', {
+    'user_id': fields.String(readOnly=True, description='The user who own this shopcart'),
+    'item_count': fields.Integer(readOnly=True, description='The number of products in the shopcart'),
+    'total_quantity': fields.Float(readOnly=True, description='The sum of the quantities of the products'),
+    'subtotal': fields.Float(readOnly=True, description='The sum of price times quantity of the products'),
+})
+
 # query string arguments
 product_args = reqparse.RequestParser()
 
@@ -73,6 +128,12 @@ product_args.add_argument('max-price', type=str, required=True, help='List produ
 product_args.add_argument('min-price', type=str, required=True, help='List products by min-price', location='args')
 product_args.add_argument('order-type', type=str, required=True, help='List product by order type', location='args')
 
+shopcart_args = reqparse.RequestParser()
+shopcart_args.add_argument('user-id', type=str, required=False, action='append', location='args',
+                           help='List the shopcart of a user, or of many users when repeated or comma separated')
+shopcart_args.add_argument('limit', type=int, required=False, help='Maximum number of shopcarts per page', location='args')
+shopcart_args.add_argument('cursor', type=str, required=False, help='Cursor of the next page', location='args')
+
 
 ######################################################################
 # Authorization Decorator
@@ -89,6 +150,87 @@ def token_required(f):
     return decorated
 
 
+def admin_key_required(f):
+    """Requires the X-Api-Key header to be the API key of the app
+
+    Unlike token_required, a missing or wrong key is always rejected, and
+    the key is compared in constant time
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        expected = app.config.get('API_KEY')
+        token = request.headers.get('X-Api-Key', '')
+        if expected and secrets.compare_digest(token.encode("utf-8"), expected.encode("utf-8")):
+            return f(*args, **kwargs)
+        return jsonify(message='Invalid or missing token'), status.HTTP_401_UNAUTHORIZED
+    return decorated
+
+
+######################################################################
+# Admin Endpoints
+######################################################################
+@app.route("/admin/slow-queries")
+@admin_key_required
+def list_slow_queries():
+    """The latest statements of this worker slower than SLOW_QUERY_MS"""
+    return jsonify(threshold_ms=slow_queries.threshold_ms, queries=slow_queries.records()), status.HTTP_200_OK
+
+
+@app.route("/admin/slow-queries", methods=["DELETE"])
+@admin_key_required
+def clear_slow_queries():
+    """Forgets the slow statements of this worker"""
+    slow_queries.clear()
+    return "", status.HTTP_204_NO_CONTENT
+
+
+######################################################################
+# Marshalling Decorator
+######################################################################
+def marshal_with(model, **kwargs):
+    """Marshals and documents like api.marshal_with, except that a
+    Response returned by the method (e.g. a stream) is passed through as is
+
+    Bodies that already have exactly the fields of a flat model, such as the
+    output of serialize(), are not walked again by the marshaller unless the
+    client asks for a subset of the fields with the X-Fields mask header
+    """
+    def decorator(func):
+        marshal = api.marshal_with(model, **kwargs)(lambda resp: resp)
+        names = model.resolved.keys()
+        fast = is_flat(model) and not kwargs.keys() & {"envelope", "skip_none", "mask"}
+
+        @wraps(func)
+        def decorated(*args, **kw):
+            resp = func(*args, **kw)
+            if isinstance(resp, Response):
+                return resp
+            if fast and not request.headers.get(app.config["RESTX_MASK_HEADER"]) and \
+                    conforms(resp[0] if isinstance(resp, tuple) else resp, names):
+                return resp
+            return marshal(resp)
+        decorated.__apidoc__ = merge(getattr(func, "__apidoc__", {}), marshal.__apidoc__)
+        return decorated
+    return decorator
+
+
+def is_flat(model):
+    """Checks that a model has no nested models, so that its fields format values as they are"""
+    for field in model.resolved.values():
+        if isinstance(field, fields.List):
+            field = field.container
+        if isinstance(field, fields.Nested):
+            return False
+    return True
+
+
+def conforms(data, names):
+    """Checks whether a body, or every item of a list body, has exactly the given fields"""
+    if isinstance(data, list):
+        return all(type(item) is dict and item.keys() == names for item in data)  # pylint: disable=unidiomatic-typecheck
+    return type(data) is dict and data.keys() == names  # pylint: disable=unidiomatic-typecheck
+
+
 ######################################################################
 # Function to generate a random API key (good for testing)
 ######################################################################
@@ -116,8 +258,10 @@ class ShopcartResource(Resource):
     # READ A SHOPCART
     ######################################################################
     @api.doc('get_shopcart')
+    @api.response(304, 'Shopcart not modified')
     @api.response(404, 'Shopcart not found')
-    @api.marshal_with(id_shopcart_model)
+    @marshal_with(id_shopcart_model)
+    @query_budget(3)
     def get(self, user_id):
         """Read a shopcart
             Args:
@@ -126,16 +270,15 @@ class ShopcartResource(Resource):
                 dict: the shopcart and it's value
         """
 
-        app.logger.info(f"Request to Read shopcart {user_id}...")
+        app.logger.info("Request to Read shopcart %s...", user_id)
 
-        # See if the shopcart already exists and send an error if it does
-        shopcarts = Shopcarts.find_by_user_id(user_id).all()
-        if len(shopcarts) == 0:
-            abort(status.HTTP_404_NOT_FOUND, f"Shopcart with id '{user_id}' was not found.")
+        def load_shopcart():
+            shopcart = Shopcarts.find_by_user_id_with_products(user_id).first()
+            return shopcart.serialize() if shopcart else None
 
-        # Return the new shopcart
-        app.logger.info("Returning shopcart: %s", user_id)
-        return shopcarts[0].serialize(), status.HTTP_200_OK
+        # Return the shopcart, or 304 if the client already has this version
+        app.logger.debug("Returning shopcart: %s", user_id)
+        return read_cart(user_id, "shopcart", load_shopcart)
 
     ######################################################################
     # UPDATE A SHOPCART
@@ -143,9 +286,11 @@ class ShopcartResource(Resource):
     @api.doc('update_shopcart', security='apikey')
     @api.response(404, 'Shopcart not found')
     @api.response(400, 'The posted Shopcart data was not valid')
+    @api.response(412, 'The shopcart changed since the If-Match ETag')
     @api.expect(shopcart_model)
-    @api.marshal_with(shopcart_model)
+    @marshal_with(shopcart_model)
     @token_required
+    @query_budget(8)
     def put(self, user_id):
         """Update items in shopcart
         Args:
@@ -153,7 +298,7 @@ class ShopcartResource(Resource):
         Returns:
             dict: the shopcart and it's value
         """
-        app.logger.info(f"Request to update a shopcart for {user_id}")
+        app.logger.info("Request to update a shopcart for %s", user_id)
         check_content_type("application/json")
         shopcarts = Shopcarts.find_by_user_id(user_id).all()
 
@@ -162,16 +307,12 @@ class ShopcartResource(Resource):
 
         shopcart = shopcarts[0]
 
-        for product in shopcart.products:
-            product.delete()
-
-        for req in api.payload:
-            # Create a product
-            product = Products()
-            product.deserialize(req)
-            product.create()
+        # Validate every product before touching the stored ones
+        products = [Products().deserialize(req) for req in api.payload]
+        shopcart.replace_products(products, if_match_versions())
+        cart_cache.invalidate(user_id)
 
-        return shopcart.serialize(), status.HTTP_200_OK
+        return shopcart.serialize(), status.HTTP_200_OK, etag_header(user_id)
 
     ######################################################################
     # DELETE A SHOPCART
@@ -180,6 +321,7 @@ class ShopcartResource(Resource):
     @api.response(404, 'Shopcart not found')
     @api.response(204, 'Shopcart deleted')
     @token_required
+    @query_budget(3)
     def delete(self, user_id):
         """Deletes a shopcart
             Args:
@@ -187,12 +329,13 @@ class ShopcartResource(Resource):
             Returns:
                 str: always returns an empty string
         """
-        app.logger.info(f"Request to Delete shopcart {user_id}...")
+        app.logger.info("Request to Delete shopcart %s...", user_id)
 
         shopcarts = Shopcarts.find_by_user_id(user_id).all()
         if len(shopcarts) != 0:
             for shopcart in shopcarts:
                 shopcart.delete()
+        cart_cache.invalidate(user_id)
 
         # Return nothing but 204 status code
         app.logger.info("Shopcart %s delete complete", user_id)
@@ -219,8 +362,9 @@ class ShopcartCollection(Resource):
     @api.doc('create_shopcart', security='apikey')
     @api.response(400, 'The posted data was not valid')
     @api.expect(shopcart_model)
-    @api.marshal_with(id_shopcart_model, code=201)
+    @marshal_with(id_shopcart_model, code=201)
     @token_required
+    @query_budget(5)
     def post(self):
         """Creates a new shopcart and stores it in the database
         Args:
@@ -242,6 +386,7 @@ class ShopcartCollection(Resource):
         # Create the new shopcart
         shopcart = Shopcarts(user_id=user_id)
         shopcart.create()
+        cart_cache.invalidate(user_id)
         # Set the location header and return the new shopcart
         location_url = api.url_for(ShopcartResource, user_id=user_id, _external=True)
         return (
@@ -255,26 +400,53 @@ class ShopcartCollection(Resource):
     ######################################################################
 
     @api.doc('get_all_shopcartS')
+    @api.response(400, 'The limit or cursor was not valid')
     @api.response(404, 'Shopcart not found')
-    @api.marshal_with(id_shopcart_model)
+    @api.expect(shopcart_args)
+    @api.produces(["application/json", NDJSON])
+    @marshal_with(id_shopcart_model)
+    @query_budget(2)
     def get(self):
         """List all shopcarts
         Returns:
-            list: the list of all shopcarts and their contents
+            list: one page of shopcarts and their contents, with the next page
+            in the Link header, or every shopcart one per line when
+            application/x-ndjson is accepted
+            dict: the shopcarts keyed by user_id, when user-id is repeated or
+            comma separated
         """
         app.logger.info("Request for shopcart list")
         args = request.args
-        user_id = args.get("user-id", default="", type=str)
+        user_ids, many = get_user_ids()
+        if many:
+            return read_many_shopcarts(user_ids)
+        user_id = user_ids[0] if user_ids else ""
+        if wants_ndjson():
+            app.logger.debug("Streaming shopcarts")
+            shopcarts = Shopcarts.stream_with_products(user_id, app.config["STREAM_BATCH_SIZE"])
+            return ndjson_response(shopcart.serialize() for shopcart in shopcarts)
+
         if user_id:
-            shopcarts = []
-            shopcarts = Shopcarts.find_by_user_id(user_id).all()
-        else:
-            shopcarts = []
-            shopcarts = Shopcarts.all()
+            shopcarts = Shopcarts.find_by_user_id_with_products(user_id).all()
+            results = [shopcart.serialize() for shopcart in shopcarts]
+            app.logger.debug("Returning %d shopcarts", len(results))
+            return results, status.HTTP_200_OK
+
+        limit = get_page_limit()
+        after_id = decode_cursor(args.get("cursor"))
+        # fetch one extra row to find out whether there is a next page
+        shopcarts = Shopcarts.page_with_products(after_id, limit + 1)
+        headers = {}
+        if len(shopcarts) > limit:
+            shopcarts = shopcarts[:limit]
+            next_cursor = encode_cursor(shopcarts[-1].id)
+            next_url = api.url_for(ShopcartCollection, limit=limit, cursor=next_cursor, _external=True)
+            headers["Link"] = f'<{next_url}>; rel="next"'
+            headers["X-Next-Cursor"] = next_cursor
 
         results = [shopcart.serialize() for shopcart in shopcarts]
-        app.logger.info("Returning %d shopcarts", len(results))
-        return results, status.HTTP_200_OK
+        app.logger.debug("Returning %d shopcarts", len(results))
+        return results, status.HTTP_200_OK, headers
 
 
 ######################################################################
@@ -298,7 +470,8 @@ class ProductResource(Resource):
     ######################################################################
     @api.doc('get_product')
     @api.response(404, 'Product not found')
-    @api.marshal_with(product_model)
+    @marshal_with(product_model)
+    @query_budget(1)
     def get(self, user_id, product_id):
         """Read a product in the shopcart
         Args:
@@ -307,14 +480,14 @@ class ProductResource(Resource):
         Returns:
             dict: the product
         """
-        app.logger.info(f"Read a product {product_id} in the shopcart {user_id}")
+        app.logger.info("Read a product %s in the shopcart %s", product_id, user_id)
         products = Products.find_by_user_id_product_id(user_id, product_id).all()
 
         if len(products) == 0:
             abort(status.HTTP_404_NOT_FOUND, f"Product with id {product_id} was not found in shopcart {user_id}.")
 
         # Return the new shopcart
-        app.logger.info("Returning product: %s", product_id)
+        app.logger.debug("Returning product: %s", product_id)
         return products[0].serialize(), status.HTTP_200_OK
 
     ######################################################################
@@ -323,9 +496,12 @@ class ProductResource(Resource):
     @api.doc('update_product', security='apikey')
     @api.response(404, 'Product not found')
     @api.response(400, 'The posted Product data was not valid')
+    @api.response(409, 'The shopcart already has a product with the product_id')
+    @api.response(412, 'The shopcart changed since the If-Match ETag')
     @api.expect(product_model)
-    @api.marshal_with(product_model)
+    @marshal_with(product_model)
     @token_required
+    @query_budget(10)
     def put(self, user_id, product_id):
         """Update a product in the shopcart
         Args:
@@ -334,22 +510,24 @@ class ProductResource(Resource):
         Returns:
             dict: the product
         """
-        app.logger.info(f"Read a product {product_id} in the shopcart {user_id}")
+        app.logger.info("Read a product %s in the shopcart %s", product_id, user_id)
         products = Products.find_by_user_id_product_id(user_id, product_id).all()
 
         if len(products) == 0:
             abort(status.HTTP_404_NOT_FOUND, f"Product with id {product_id} was not found in shopcart {user_id}.")
 
         # Return the list of products
-        app.logger.info("Updating product")
+        app.logger.debug("Updating product")
         originial_id = products[0].id
         product = products[0]
         product.deserialize(api.payload)
         product.id = originial_id
-        product.update()
+        product.update(if_match_versions())
+        cart_cache.invalidate(user_id)
+        cart_cache.invalidate(product.user_id)
 
         app.logger.info("Product %s in shopcart %s was updated.", product_id, user_id)
-        return product.serialize(), status.HTTP_200_OK
+        return product.serialize(), status.HTTP_200_OK, etag_header(user_id)
 
     ######################################################################
     # DELETE A Product
@@ -358,6 +536,7 @@ class ProductResource(Resource):
     @api.response(404, 'Product not found')
     @api.response(204, 'Product deleted')
     @token_required
+    @query_budget(6)
     def delete(self, user_id, product_id):
         """Update a product in the shopcart
         Args:
@@ -366,14 +545,15 @@ class ProductResource(Resource):
         Returns:
             str: always returns an empty string
         """
-        app.logger.info(f"Delete a product {product_id} in the shopcart {user_id}")
+        app.logger.info("Delete a product %s in the shopcart %s", product_id, user_id)
         products = Products.find_by_user_id_product_id(user_id, product_id).all()
 
-        app.logger.info("Deleting product")
+        app.logger.debug("Deleting product")
         if len(products) != 0:
             # Return the list of products
             product = products[0]
             product.delete()
+            cart_cache.invalidate(user_id)
 
         app.logger.info("Product %s in shopcart %s was deleted.", product_id, user_id)
         return "", status.HTTP_204_NO_CONTENT
@@ -396,51 +576,35 @@ class ItemsResource(Resource):
     # READ A Product
     ######################################################################
     @api.doc('get_product')
-    # @api.response(404, 'Product not found')
+    @api.response(304, 'Products not modified')
+    @api.response(404, 'Shopcart not found')
     @api.expect(product_args, validate=True)
-    @api.marshal_with(record_model)
+    @api.produces(["application/json", NDJSON])
+    @marshal_with(record_model)
+    @query_budget(2)
     def get(self, user_id):
         """Read all products in the shopcart
         Args:
             user_id (str): the user_id of the shopcart
         Returns:
-            list: the list of products in the shopcart
+            list: the list of products in the shopcart, one per line when
+            application/x-ndjson is accepted
         """
-        shopcarts = Shopcarts.find_by_user_id(user_id).all()
-        if len(shopcarts) == 0:
-            abort(status.HTTP_404_NOT_FOUND, f"Shopcart with id '{user_id}' was not found.")
-        app.logger.info(f"Read products in the shopcart {user_id}")
-
-        try:
-            args = request.args
-            if args.get('max-price') or args.get('max-price'):
-                if args.get('max-price'):
-                    max_price = args.get('max-price')
-                    app.logger.info(f"Have max-price {max_price}")
-                if args.get('min-price'):
-                    min_price = args.get('min-price')
-                    app.logger.info(f"Have min-price {min_price}")
-                products = Products.find_product_with_range(user_id, max_price, min_price).all()
-            elif args.get('order-type'):
-                order_type = args.get('order-type')
-                app.logger.info(f"Have order-type {order_type}")
-                products = Products.find_product_with_order(user_id, order_type).all()
-            else:
-                max_price = args.get('max-price')
-                min_price = args.get('min-price')
-                products = Products.find_product_with_range(user_id, max_price, min_price).all()
-                order_type = args.get('order-type')
-                products = Products.find_product_with_order(user_id, order_type).all()
-        except Exception as e:
-            app.logger.info(e)
-            products = Products.find_product(user_id).all()
-
-        # Return the list of products
-        app.logger.info("Returning products")
-        serialized_products = []
-        for product in products:
-            serialized_products.append(product.serialize())
-        return serialized_products, status.HTTP_200_OK
+        app.logger.info("Read products in the shopcart %s", user_id)
+        if wants_ndjson():
+            if len(Shopcarts.find_by_user_id(user_id).all()) == 0:
+                abort(status.HTTP_404_NOT_FOUND, f"Shopcart with id '{user_id}' was not found.")
+            app.logger.debug("Streaming products")
+            query = find_products(user_id, request.args, streaming=True)
+            return ndjson_response(Products.serialize_rows(query.yield_per(app.config["STREAM_BATCH_SIZE"])))
+
+        def load_products():
+            return find_products(user_id, request.args)
+
+        # Return the list of products, or 304 if the client already has this version
+        variant = ("items",) + tuple(sorted(request.args.items(multi=True)))
+        app.logger.debug("Returning products")
+        return read_cart(user_id, variant, load_products)
 
     ######################################################################
     # Add A Product
@@ -448,8 +612,9 @@ class ItemsResource(Resource):
     @api.doc('add_product', security='apikey')
     @api.response(400, 'The posted data was not valid')
     @api.expect(product_model)
-    @api.marshal_with(record_model, code=201)
+    @marshal_with(record_model, code=201)
     @token_required
+    @query_budget(7)
     def post(self, user_id):
         """
         Add a product to the shopcart
@@ -466,7 +631,8 @@ class ItemsResource(Resource):
         if len(shopcarts) == 0:
             abort(status.HTTP_404_NOT_FOUND, f"Shopcart {product.user_id} does not exist")
         product.create()
-        app.logger.info(f"Product {product.product_id} created in shopcart {user_id}")
+        cart_cache.invalidate(product.user_id)
+        app.logger.info("Product %s created in shopcart %s", product.product_id, user_id)
 
         # Set the location header and return the new product
         location_url = api.url_for(ProductResource, user_id=user_id, product_id=product.product_id, _external=True)
@@ -477,6 +643,97 @@ class ItemsResource(Resource):
         )
 
 
+######################################################################
+#  PATH: /shopcart/{user_id}/items:batch
+######################################################################
+@api.route('/shopcarts/<user_id>/items:batch')
+@api.param('user_id', 'The shopcart identifier')
+class ItemsBatchResource(Resource):
+    """
+    ItemsBatchResource class
+
+    Allows many products to be added to a shopcart at once
+    POST /shopcart/{user_id}/items:batch - Add or update a list of products with the user id
+    """
+    ######################################################################
+    # Add Many Products
+    ######################################################################
+    @api.doc('add_products', security='apikey')
+    @api.response(400, 'The posted data was not valid')
+    @api.response(404, 'Shopcart not found')
+    @api.expect([product_model])
+    @api.marshal_list_with(batch_result_model)
+    @token_required
+    @query_budget(8)
+    def post(self, user_id):
+        """
+        Add a list of products to the shopcart in one transaction
+        Args:
+            user_id (str): the user_id of the shopcart
+        Returns:
+            list: whether each product was created or updated, and the stored product
+        """
+        app.logger.info("Request to add a batch of products to shopcart %s", user_id)
+        check_content_type("application/json")
+        products = deserialize_batch(user_id, api.payload)
+        shopcart = Shopcarts.find_by_user_id(user_id).first()
+        if shopcart is None:
+            abort(status.HTTP_404_NOT_FOUND, f"Shopcart {user_id} does not exist")
+        results = shopcart.add_products(products)
+        cart_cache.invalidate(user_id)
+        app.logger.info("Added %d products to shopcart %s", len(results), user_id)
+        return (
+            [{"status": "created" if created else "updated", "product": product.serialize()}
+             for product, created in results],
+            status.HTTP_200_OK,
+            etag_header(user_id),
+        )
+
+
+######################################################################
+#  PATH: /shopcart/{user_id}/summary
+######################################################################
+@api.route('/shopcarts/<user_id>/summary')
+@api.param('user_id', 'The shopcart identifier')
+class SummaryResource(Resource):
+    """
+    SummaryResource class
+
+    Allows the totals of a single shopcart to be read
+    GET /shopcart/{user_id}/summary - Get the item count and subtotal of the shopcart
+    """
+    ######################################################################
+    # READ A Shopcart Summary
+    ######################################################################
+    @api.doc('get_shopcart_summary')
+    @api.response(304, 'Shopcart not modified')
+    @api.response(404, 'Shopcart not found')
+    @marshal_with(summary_model)
+    @query_budget(2)
+    def get(self, user_id):
+        """Read the totals of a shopcart
+        Args:
+            user_id (str): the user_id of the shopcart
+        Returns:
+            dict: the item count, total quantity and subtotal of the shopcart
+        """
+        app.logger.info("Request for the summary of shopcart %s", user_id)
+
+        def load_summary():
+            totals = Shopcarts.find_totals(user_id)
+            if totals is None:
+                return None
+            return {
+                "user_id": user_id,
+                "item_count": totals.item_count,
+                "total_quantity": totals.total_quantity,
+                "subtotal": totals.subtotal,
+            }
+
+        # Return the totals, or 304 if the client already has this version
+        return read_cart(user_id, "summary", load_summary)
+
+
 ######################################################################
 #  PATH: /shopcart/{user_id}/empty
 ######################################################################
@@ -494,6 +751,7 @@ class EmptyResource(Resource):
     ######################################################################
     @api.doc('empty_a_shopcart')
     @api.response(404, 'User_id not found')
+    @query_budget(5)
     def put(self, user_id):
         """Empty a shopcart
         Args:
@@ -501,7 +759,7 @@ class EmptyResource(Resource):
         Returns:
             dict: the emptied shopcart
         """
-        app.logger.info(f"Request to Reset shopcart {user_id}...")
+        app.logger.info("Request to Reset shopcart %s...", user_id)
 
         # Get the current shopcart
         shopcarts = Shopcarts.find_by_user_id(user_id).all()
@@ -511,6 +769,7 @@ class EmptyResource(Resource):
         # empty the shopcart
         shopcart = shopcarts[0]
         shopcart.empty()
+        cart_cache.invalidate(user_id)
 
         return shopcart.serialize()
 
@@ -520,6 +779,244 @@ class EmptyResource(Resource):
 ######################################################################
 
 
+def get_user_ids():
+    """Returns the distinct user ids of the repeated or comma separated user-id arguments
+
+    Returns:
+        (list, bool): the user ids, and whether the many user-id form was
+        used, even if it names a single user, e.g. user-id=a,a
+    """
+    values = request.args.getlist("user-id")
+    many = len(values) > 1 or any("," in value for value in values)
+    user_ids = []
+    for value in values:
+        for user_id in value.split(","):
+            if user_id and user_id not in user_ids:
+                user_ids.append(user_id)
+    if len(user_ids) > app.config["SHOPCARTS_MAX_USER_IDS"]:
+        abort(status.HTTP_400_BAD_REQUEST,
+              f"At most {app.config['SHOPCARTS_MAX_USER_IDS']} user-id can be requested at once")
+    return user_ids, many
+
+
+def read_many_shopcarts(user_ids):
+    """Returns the shopcarts of many users keyed by user_id, null for the missing ones"""
+    shopcarts = Shopcarts.find_by_user_ids_with_products(user_ids).all()
+    found = dict((shopcart.user_id, api.marshal(shopcart.serialize(), id_shopcart_model)) for shopcart in shopcarts)
+    app.logger.debug("Returning %d of %d shopcarts", len(found), len(user_ids))
+    return api.make_response(dict((user_id, found.get(user_id)) for user_id in user_ids), status.HTTP_200_OK)
+
+
+def make_etag(shopcart_version):
+    """Makes the entity tag of a shopcart from its id and version"""
+    return f"{shopcart_version.id}-{shopcart_version.version}"
+
+
+def etag_header(user_id):
+    """Returns the ETag header with the current version of a shopcart"""
+    shopcart_version = Shopcarts.find_version(user_id)
+    if shopcart_version is None:
+        return {}
+    return {"ETag": quote_etag(make_etag(shopcart_version))}
+
+
+def if_match_versions():
+    """Returns the (id, version) pairs of the shopcart ETags in If-Match
+
+    Returns:
+        list: the pairs, or None when the request has no If-Match or If-Match: *
+    """
+    if not request.if_match or request.if_match.star_tag:
+        return None
+    versions = []
+    for etag in request.if_match:
+        by_id, _, version = identity_etag(etag).partition("-")
+        if by_id.isdigit() and version.isdigit():
+            versions.append((int(by_id), int(version)))
+    app.logger.debug("Expecting shopcart versions %s", versions)
+    return versions
+
+
+def read_cart(user_id, key, loader):
+    """Reads a representation of a shopcart through the cart cache
+
+    A conditional request is answered with 304 Not Modified from the cached
+    entity tag, or on a cache miss from the shopcart version alone, without
+    loading the products
+
+    Args:
+        user_id (str): the user_id of the shopcart
+        key: identifies the representation within the shopcart cache namespace
+        loader: returns the serialized representation
+    Returns:
+        the representation with its ETag header, or a 304 Response
+    """
+    unchanged = None
+
+    def load():
+        nonlocal unchanged
+        shopcart_version = Shopcarts.find_version(user_id)
+        if shopcart_version is None:
+            abort(status.HTTP_404_NOT_FOUND, f"Shopcart with id '{user_id}' was not found.")
+        etag = make_etag(shopcart_version)
+        unchanged = if_none_match(etag)
+        if unchanged is not None:
+            # None is not cached, the next request loads the products again
+            return None
+        body = loader()
+        if body is None:
+            abort(status.HTTP_404_NOT_FOUND, f"Shopcart with id '{user_id}' was not found.")
+        return etag, body
+
+    cached = cart_cache.get_or_load(user_id, key, load)
+    if cached is None:
+        return not_modified(unchanged)
+    etag, body = cached
+    matched = if_none_match(etag)
+    if matched is not None:
+        return not_modified(matched)
+    return body, status.HTTP_200_OK, {"ETag": quote_etag(etag)}
+
+
+def if_none_match(etag):
+    """Returns the entity tag of If-None-Match that matches etag in any content coding
+
+    The tag the client sent back is the one of the representation it has,
+    e.g. "1-42-gzip", which the 304 Not Modified response repeats
+
+    Returns:
+        str: the matching entity tag, or None when the representation changed
+    """
+    if request.if_none_match.star_tag:
+        return etag
+    for tag in request.if_none_match.as_set(include_weak=True):
+        if identity_etag(tag) == etag:
+            return tag
+    return None
+
+
+def not_modified(etag):
+    """Returns an empty 304 Not Modified response for the entity tag"""
+    app.logger.debug("Returning not modified %s", etag)
+    return Response(status=status.HTTP_304_NOT_MODIFIED, headers={"ETag": quote_etag(etag)})
+
+
+def deserialize_batch(user_id, payload):
+    """Deserializes the products of a batch, all of them or none
+
+    Args:
+        user_id (str): the user_id of the shopcart the products must be in
+        payload: the request body, a list of products
+    Returns:
+        list: the deserialized Products
+    """
+    if not isinstance(payload, list):
+        api.abort(status.HTTP_400_BAD_REQUEST, "The body must be a list of products")
+    if len(payload) > app.config["ITEMS_MAX_BATCH_SIZE"]:
+        api.abort(status.HTTP_400_BAD_REQUEST,
+                  f"A batch holds at most {app.config['ITEMS_MAX_BATCH_SIZE']} products")
+    products = []
+    errors = []
+    for index, data in enumerate(payload):
+        try:
+            product = Products().deserialize(data)
+        except (DataValidationError, ValueError) as error:
+            errors.append({"index": index, "message": str(error)})
+            continue
+        if product.user_id != user_id:
+            errors.append({"index": index, "message": f"user_id must be {user_id}"})
+            continue
+        products.append(product)
+    if errors:
+        api.abort(status.HTTP_400_BAD_REQUEST, f"{len(errors)} products are not valid", errors=errors)
+    return products
+
+
+def find_products(user_id, args, streaming=False):
+    """Returns the products of a shopcart matching the query arguments
+
+    The products are a list of serialized products, or a query still to be
+    run when streaming
+    """
+    try:
+        if args.get('max-price') or args.get('max-price'):
+            if args.get('max-price'):
+                max_price = args.get('max-price')
+                app.logger.debug("Have max-price %s", max_price)
+            if args.get('min-price'):
+                min_price = args.get('min-price')
+                app.logger.debug("Have min-price %s", min_price)
+            query = Products.find_product_with_range(user_id, max_price, min_price)
+        else:
+            order_type = args.get('order-type')
+            if order_type:
+                app.logger.debug("Have order-type %s", order_type)
+            query = Products.find_product_with_order(user_id, order_type)
+        return query if streaming else list(Products.serialize_rows(query))
+    except Exception as e:  # pylint: disable=broad-except
+        app.logger.info(e)
+        query = Products.find_product(user_id)
+        return query if streaming else list(Products.serialize_rows(query))
+
+
+def wants_ndjson():
+    """Checks whether the client prefers a newline delimited JSON stream
+
+    The response then depends on the Accept header, which it names in Vary
+    so that a cache keeps the JSON and the NDJSON responses apart
+    """
+    @after_this_request
+    def vary_on_accept(response):  # pylint: disable=unused-variable
+        response.vary.add("Accept")
+        return response
+
+    return request.accept_mimetypes.best_match(["application/json", NDJSON]) == NDJSON
+
+
+def ndjson_response(records):
+    """Streams the serialized records as newline delimited JSON
+
+    The records are an iterable of dictionaries, serialized one at a time
+    while the response is being sent, so memory use does not grow with the
+    number of records
+    """
+    def generate():
+        for record in records:
+            yield json_line(record)
+
+    return Response(stream_with_context(generate()), status=status.HTTP_200_OK, mimetype=NDJSON)
+
+
+def get_page_limit():
+    """Returns the requested page size, capped at the configured maximum"""
+    limit = request.args.get("limit", default=str(app.config["SHOPCARTS_PAGE_SIZE"]))
+    if not limit.isdigit() or int(limit) < 1:
+        app.logger.error("Invalid limit: %s", limit)
+        abort(status.HTTP_400_BAD_REQUEST, "limit must be a positive integer")
+    return min(int(limit), app.config["SHOPCARTS_MAX_PAGE_SIZE"])
+
+
+def encode_cursor(last_id):
+    """Encodes the id of the last shopcart of a page into an opaque cursor"""
+    return base64.urlsafe_b64encode(f"id:{last_id}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor made by encode_cursor back into a shopcart id"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        prefix, last_id = base64.urlsafe_b64decode(padded).decode().split(":")
+        if prefix != "id":
+            raise ValueError(prefix)
+        return int(last_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        app.logger.error("Invalid cursor: %s", cursor)
+        abort(status.HTTP_400_BAD_REQUEST, "cursor is not valid")
+    return None
+
+
 def check_content_type(content_type):
     """Checks that the media type is correct"""
     if "Content-Type" not in request.headers:
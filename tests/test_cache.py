@@ -0,0 +1,97 @@
+"""
+Test cases for the Cart Cache
+"""
+import time
+from unittest import TestCase
+from unittest.mock import patch
+from service.common.cache import LRUCache, NullCache, init_cache
+
+
+class TestLRUCache(TestCase):
+    """Test Cases for the in-process LRU cache"""
+
+    def test_read_through(self):
+        """It should only call the loader on a miss"""
+        cache = LRUCache(max_size=10, ttl=60)
+        calls = []
+
+        def loader():
+            calls.append(1)
+            return {"user_id": "1"}
+
+        self.assertEqual(cache.get_or_load("1", "shopcart", loader), {"user_id": "1"})
+        self.assertEqual(cache.get_or_load("1", "shopcart", loader), {"user_id": "1"})
+        self.assertEqual(len(calls), 1)
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["size"], 1)
+
+    def test_none_not_cached(self):
+        """It should not cache missing values"""
+        cache = LRUCache()
+        self.assertIsNone(cache.get_or_load("1", "shopcart", lambda: None))
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_invalidate_namespace(self):
+        """It should drop every value of an invalidated namespace"""
+        cache = LRUCache()
+        cache.set("1", "shopcart", "cart 1")
+        cache.set("1", "items", "items 1")
+        cache.set("2", "shopcart", "cart 2")
+        cache.invalidate("1")
+        self.assertIsNone(cache.get("1", "shopcart"))
+        self.assertIsNone(cache.get("1", "items"))
+        self.assertEqual(cache.get("2", "shopcart"), "cart 2")
+
+    def test_invalidate_during_load(self):
+        """It should not cache a value loaded while the namespace was invalidated"""
+        cache = LRUCache()
+
+        def loader():
+            cache.invalidate("1")
+            return "stale"
+
+        self.assertEqual(cache.get_or_load("1", "shopcart", loader), "stale")
+        self.assertIsNone(cache.get("1", "shopcart"))
+
+    def test_evict_least_recently_used(self):
+        """It should evict the least recently used value when full"""
+        cache = LRUCache(max_size=2)
+        cache.set("1", "shopcart", "cart 1")
+        cache.set("2", "shopcart", "cart 2")
+        cache.get("1", "shopcart")
+        cache.set("3", "shopcart", "cart 3")
+        self.assertIsNone(cache.get("2", "shopcart"))
+        self.assertEqual(cache.get("1", "shopcart"), "cart 1")
+        self.assertEqual(cache.get("3", "shopcart"), "cart 3")
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_expire(self):
+        """It should expire values older than the ttl"""
+        cache = LRUCache(ttl=10)
+        now = time.monotonic()
+        with patch("service.common.cache.time.monotonic", return_value=now):
+            cache.set("1", "shopcart", "cart 1")
+        with patch("service.common.cache.time.monotonic", return_value=now + 11):
+            self.assertIsNone(cache.get("1", "shopcart"))
+        stats = cache.stats()
+        self.assertEqual(stats["expirations"], 1)
+        self.assertEqual(stats["size"], 0)
+
+    def test_init_cache(self):
+        """It should create the configured cache"""
+        config = {"CACHE_TYPE": "lru", "CACHE_MAX_SIZE": 5, "CACHE_TTL": 1}
+        app = type("App", (), {"config": config})
+        self.assertIsInstance(init_cache(app), LRUCache)
+        config["CACHE_TYPE"] = "none"
+        self.assertIsInstance(init_cache(app), NullCache)
+        config["CACHE_TYPE"] = "memcached"
+        self.assertRaises(ValueError, init_cache, app)
+
+    def test_null_cache(self):
+        """It should always call the loader when caching is off"""
+        cache = NullCache()
+        self.assertEqual(cache.get_or_load("1", "shopcart", lambda: "cart"), "cart")
+        self.assertIsNone(cache.get("1", "shopcart"))
+        self.assertEqual(cache.stats()["misses"], 2)
@@ -2,10 +2,13 @@
 CLI Command Extensions for Flask
 """
 import os
+import tempfile
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
 from click.testing import CliRunner
-from service.common.cli_commands import create_db
+from sqlalchemy import create_engine, inspect, text
+from service.common.cli_commands import add_columns, create_db, create_indexes, reconcile_carts
+from service.models import db
 
 
 class TestFlaskCLI(TestCase):
@@ -21,3 +24,53 @@ class TestFlaskCLI(TestCase):
         with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
             result = self.runner.invoke(create_db)
             self.assertEqual(result.exit_code, 0)
+
+    @patch('service.common.cli_commands.db')
+    def test_create_indexes(self, db_mock):
+        """It should call the create-indexes command"""
+        index = MagicMock()
+        table = MagicMock(indexes=[index])
+        db_mock.metadata.sorted_tables = [table]
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            result = self.runner.invoke(create_indexes)
+            self.assertEqual(result.exit_code, 0)
+        index.create.assert_called_once_with(bind=db_mock.engine, checkfirst=True)
+
+    def test_add_columns(self):
+        """It should add the missing columns to an existing table with their defaults"""
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine(f"sqlite:///{os.path.join(directory, 'old.db')}")
+            with engine.begin() as connection:
+                connection.execute(text(
+                    "CREATE TABLE shopcarts (id INTEGER PRIMARY KEY, user_id VARCHAR(63) NOT NULL UNIQUE)"
+                ))
+                connection.execute(text("INSERT INTO shopcarts (user_id) VALUES ('old')"))
+            db_mock = MagicMock(engine=engine, metadata=db.metadata)
+            try:
+                with patch('service.common.cli_commands.db', db_mock), \
+                        patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+                    result = self.runner.invoke(add_columns)
+                    self.assertEqual(result.exit_code, 0)
+                    self.assertIn("shopcarts.version", result.output)
+                    with engine.connect() as connection:
+                        row = connection.execute(text(
+                            "SELECT version, item_count, total_quantity, subtotal FROM shopcarts"
+                        )).one()
+                    self.assertEqual(tuple(row), (1, 0, 0, 0))
+                    self.assertFalse(inspect(engine).has_table("products"))
+                    # nothing is left to add
+                    result = self.runner.invoke(add_columns)
+                    self.assertEqual(result.exit_code, 0)
+                    self.assertEqual(result.output, "")
+            finally:
+                engine.dispose()
+
+    @patch('service.common.cli_commands.Shopcarts')
+    def test_reconcile_carts(self, shopcarts_mock):
+        """It should call the reconcile-carts command"""
+        shopcarts_mock.reconcile.return_value = 3
+        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+            result = self.runner.invoke(reconcile_carts)
+            self.assertEqual(result.exit_code, 0)
+        shopcarts_mock.reconcile.assert_called_once_with()
+        self.assertIn("3 shopcarts", result.output)
@@ -0,0 +1,109 @@
+"""
+Test cases for the Response Compression
+"""
+import gzip
+import json
+import zlib
+from unittest import TestCase
+from unittest.mock import patch
+from flask import Flask, Response, jsonify
+from werkzeug.datastructures import Accept
+from service import config
+from service.common import compression
+
+BIG = [{"product_id": str(i), "name": "Pen", "price": 1.5} for i in range(200)]
+
+
+def make_app():
+    """Creates an app with a big, a small, a streamed and a static response"""
+    app = Flask(__name__)
+    app.config.from_object(config)
+
+    @app.route("/big")
+    def big():
+        return jsonify(BIG)
+
+    @app.route("/small")
+    def small():
+        return jsonify(status="OK")
+
+    @app.route("/stream")
+    def stream():
+        lines = (json.dumps(item) + "\n" for item in BIG)
+        return Response(lines, mimetype="application/x-ndjson")
+
+    @app.route("/tagged")
+    def tagged():
+        resp = jsonify(BIG)
+        resp.set_etag("1-42")
+        return resp
+
+    @app.route("/image")
+    def image():
+        return Response(b"\x89PNG" * 1000, mimetype="image/png")
+
+    compression.init_compression(app)
+    return app
+
+
+class TestCompression(TestCase):
+    """Test Cases for the compression of responses"""
+
+    def setUp(self):
+        self.app = make_app()
+        self.client = self.app.test_client()
+
+    def test_compress_big_response(self):
+        """It should gzip a big JSON response"""
+        resp = self.client.get("/big", headers={"Accept-Encoding": "gzip, deflate"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+        self.assertEqual(int(resp.headers["Content-Length"]), len(resp.data))
+        self.assertEqual(json.loads(gzip.decompress(resp.data)), BIG)
+
+    def test_no_compression(self):
+        """It should not compress small bodies, other media types or for clients without gzip"""
+        resp = self.client.get("/small", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(resp.get_json(), {"status": "OK"})
+        resp = self.client.get("/image", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+        resp = self.client.get("/big")
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(resp.get_json(), BIG)
+        self.app.config["COMPRESS_ENABLED"] = False
+        resp = self.client.get("/big", headers={"Accept-Encoding": "gzip"})
+        self.assertNotIn("Content-Encoding", resp.headers)
+
+    def test_compress_stream(self):
+        """It should gzip a streamed response chunk by chunk"""
+        resp = self.client.get("/stream", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertNotIn("Content-Length", resp.headers)
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        chunks = list(resp.response)
+        # every line can be decompressed as soon as its chunk arrives
+        first = decompressor.decompress(chunks[0])
+        self.assertEqual(json.loads(first), BIG[0])
+        body = first + b"".join(decompressor.decompress(chunk) for chunk in chunks[1:])
+        self.assertEqual([json.loads(line) for line in body.splitlines()], BIG)
+
+    def test_compressed_etag(self):
+        """It should append the content coding to the strong ETag of a compressed response"""
+        resp = self.client.get("/tagged", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(resp.headers["ETag"], '"1-42-gzip"')
+        resp = self.client.get("/tagged")
+        self.assertEqual(resp.headers["ETag"], '"1-42"')
+        self.assertEqual(compression.identity_etag("1-42-gzip"), "1-42")
+        self.assertEqual(compression.identity_etag("1-42-br"), "1-42")
+        self.assertEqual(compression.identity_etag("1-42"), "1-42")
+
+    def test_choose_encoding(self):
+        """It should only offer brotli when it is installed"""
+        accept = Accept([("br", 1), ("gzip", 0.5)])
+        with patch.object(compression, "brotli", None):
+            self.assertEqual(compression.choose_encoding(accept), "gzip")
+            self.assertIsNone(compression.choose_encoding(Accept([("br", 1)])))
+        with patch.object(compression, "brotli", object()):
+            self.assertEqual(compression.choose_encoding(accept), "br")
@@ -0,0 +1,71 @@
+"""
+Test cases for the Log Handlers
+"""
+import atexit
+import io
+import json
+import logging
+import logging.handlers
+from unittest import TestCase
+from flask import Flask
+from service.common import log_handlers
+
+
+class TestLogHandlers(TestCase):
+    """Test Cases for the queued logging set up"""
+
+    def setUp(self):
+        self.app = Flask("log_handlers_test")
+        self.stream = io.StringIO()
+        self.gunicorn_logger = logging.getLogger("test.gunicorn.error")
+        self.gunicorn_logger.handlers = [logging.StreamHandler(self.stream)]
+        self.gunicorn_logger.setLevel(logging.INFO)
+
+    def tearDown(self):
+        self.gunicorn_logger.handlers = []
+
+    def _log(self, *messages, level=logging.INFO):
+        """Sets up logging, logs the messages and returns the written lines"""
+        listener = log_handlers.init_logging(self.app, self.gunicorn_logger.name)
+        for message in messages:
+            self.app.logger.log(level, "Message %s", message)
+        listener.stop()  # waits for the queue to be written out
+        atexit.unregister(listener.stop)
+        return self.stream.getvalue().splitlines()
+
+    def test_text_format(self):
+        """It should write the records through the queue in the text format"""
+        lines = self._log("one")
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[1].endswith("[INFO] [test_log_handlers] Message one"))
+        self.assertIsInstance(self.app.logger.handlers[0], logging.handlers.QueueHandler)
+
+    def test_json_format(self):
+        """It should write one JSON object per record"""
+        self.app.config["LOG_FORMAT"] = "json"
+        entry = json.loads(self._log("two")[1])
+        self.assertEqual(entry["message"], "Message two")
+        self.assertEqual(entry["level"], "INFO")
+        self.assertEqual(entry["module"], "test_log_handlers")
+
+    def test_request_sampling(self):
+        """It should drop the INFO records of requests that are not sampled"""
+        self.app.config["LOG_SAMPLE_RATE"] = 0.0
+        with self.app.test_request_context():
+            self.assertEqual(self._log("dropped"), [])
+        self.app.config["LOG_SAMPLE_RATE"] = 1.0
+        with self.app.test_request_context():
+            self.assertEqual(len(self._log("kept")), 2)
+
+    def test_warnings_are_not_sampled(self):
+        """It should keep warnings of requests that are not sampled"""
+        self.app.config["LOG_SAMPLE_RATE"] = 0.0
+        with self.app.test_request_context():
+            lines = self._log("kept", level=logging.WARNING)
+        self.assertTrue(lines[-1].endswith("Message kept"))
+
+    def test_no_handlers(self):
+        """It should not start a listener without gunicorn handlers"""
+        self.gunicorn_logger.handlers = []
+        self.assertIsNone(log_handlers.init_logging(self.app, self.gunicorn_logger.name))
+        self.assertEqual(self.app.logger.handlers, [])
@@ -6,8 +6,10 @@ import os
 import logging
 import unittest
 from datetime import date
+from sqlalchemy import event, text
+from sqlalchemy.exc import IntegrityError
 from werkzeug.exceptions import NotFound
-from service.models import Products, Shopcarts, DataValidationError, db
+from service.models import Products, Shopcarts, DataValidationError, VersionConflictError, db
 from service import app
 from tests.factories import ProductsFactory, ShopcartsFactory
 
@@ -110,6 +112,33 @@ class TestProductsModel(unittest.TestCase):
         products = Products.all()
         self.assertEqual(len(products), 1)
 
+    def test_add_a_duplicated_product_updates_it(self):
+        """It should store the new values when adding a duplicated product"""
+        Shopcarts(user_id="1").create()
+        product = Products(name="Pen", user_id="1", product_id="2",
+                           quantity=1.0, price=12, time=date(2020, 1, 1))
+        product.create()
+        original_id = product.id
+        duplicate = Products(name="Blue Pen", user_id="1", product_id="2",
+                             quantity=3.0, price=10, time=date(2020, 2, 1))
+        duplicate.create()
+        self.assertEqual(duplicate.id, original_id)
+        found = Products.find(original_id)
+        self.assertEqual(found.name, "Blue Pen")
+        self.assertEqual(found.quantity, 3.0)
+        self.assertEqual(found.price, 10)
+        self.assertEqual(found.time, date(2020, 2, 1))
+        self.assertEqual(len(Products.all()), 1)
+
+    def test_duplicated_product_rows_rejected(self):
+        """It should not store two rows for the same user_id and product_id"""
+        Shopcarts(user_id="1").create()
+        for _ in range(2):
+            db.session.add(Products(name="Pen", user_id="1", product_id="2",
+                                    quantity=1.0, price=12, time=date(2020, 1, 1)))
+        self.assertRaises(IntegrityError, db.session.commit)
+        db.session.rollback()
+
     def test_read_a_product(self):
         """It should Read a Product"""
         product = ProductsFactory()
@@ -277,6 +306,18 @@ class TestProductsModel(unittest.TestCase):
         self.assertEqual(len(found_product2), 1)
         self.assertEqual(len(found_product3), 1)
 
+    def test_serialize_rows(self):
+        """It should serialize the Products of a query like serialize() without loading them"""
+        Shopcarts(user_id="rows").create()
+        for i in range(5):
+            ProductsFactory(user_id="rows", product_id=str(i)).create()
+        db.session.expunge_all()
+        query = Products.find_product_with_order("rows", "PD")
+        rows = list(Products.serialize_rows(query))
+        self.assertEqual(len(db.session.identity_map), 0)
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows, [product.serialize() for product in query.all()])
+
     def test_query_order_type(self):
         """It should query product with different order type"""
         shopcart = ShopcartsFactory()
@@ -305,6 +346,43 @@ class TestProductsModel(unittest.TestCase):
         for i in range(len(query_product4) - 1):
             self.assertTrue(query_product4[i].time >= query_product4[i+1].time)
 
+    def _query_plan(self, query):
+        """Returns the query plan the database picks for a query"""
+        statement = query.statement.compile(dialect=db.engine.dialect, compile_kwargs={"literal_binds": True})
+        if db.engine.dialect.name == "sqlite":
+            rows = db.session.execute(text(f"EXPLAIN QUERY PLAN {statement}"))
+        else:
+            # on a test sized table the planner is free to prefer a scan
+            db.session.execute(text("SET LOCAL enable_seqscan = off"))
+            rows = db.session.execute(text(f"EXPLAIN {statement}"))
+        plan = "\n".join(str(row[-1]) for row in rows)
+        db.session.rollback()
+        return plan
+
+    def test_queries_use_indexes(self):
+        """It should use the indexes for the price range and ordering queries"""
+        for user_id in range(5):
+            Shopcarts(user_id=str(user_id)).create()
+            db.session.bulk_insert_mappings(Products, [
+                {"user_id": str(user_id), "product_id": str(i), "name": "Pen",
+                 "quantity": 1, "price": i, "time": date(2020, 1, 1 + i % 28)}
+                for i in range(100)
+            ])
+        db.session.commit()
+        db.session.execute(text("ANALYZE"))
+        db.session.commit()
+
+        plan = self._query_plan(Products.find_product_with_range("1", 50.0, 10.0))
+        self.assertIn("ix_products_user_id_price", plan)
+        for order_type, index in (("PA", "ix_products_user_id_price"), ("PD", "ix_products_user_id_price"),
+                                  ("TA", "ix_products_user_id_time"), ("TD", "ix_products_user_id_time")):
+            plan = self._query_plan(Products.find_product_with_order("1", order_type))
+            self.assertIn(index, plan)
+            self.assertNotIn("TEMP B-TREE", plan)
+            self.assertNotIn("Sort", plan)
+        plan = self._query_plan(Products.find_by_user_id("1"))
+        self.assertIn("ix_products_user_id", plan)
+
 
 class TestProductsDeserialize(unittest.TestCase):
     """ Test Cases for Products Model serialize and deserialize function """
@@ -489,6 +567,161 @@ class TestShopcartsModel(unittest.TestCase):
         self.assertEqual(len(Shopcarts.all()), 0)
         self.assertEqual(len(Products.all()), 0)
 
+    def _count_statements(self, function):
+        """Calls function and returns the number of SQL statements it issued"""
+        statements = []
+
+        def count(*_args):
+            statements.append(1)
+
+        db.session.expire_all()  # start every call from the same session state
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            function()
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        return len(statements)
+
+    def test_empty_and_delete_constant_statements(self):
+        """It should Empty and Delete a Shopcart with the same statements for any size"""
+        for user_id, count in (("small", 1), ("large", 50)):
+            Shopcarts(user_id=user_id).create()
+            db.session.bulk_insert_mappings(Products, [
+                {"user_id": user_id, "product_id": str(i), "name": "Pen",
+                 "quantity": 1, "price": i, "time": date(2020, 1, 1)}
+                for i in range(count)
+            ])
+        db.session.commit()
+        small = Shopcarts.find_by_user_id("small").first()
+        large = Shopcarts.find_by_user_id("large").first()
+        self.assertEqual(len(large.products), 50)
+        self.assertEqual(self._count_statements(large.empty), self._count_statements(small.empty))
+        self.assertEqual(large.products, [])
+        self.assertEqual(len(Products.all()), 0)
+
+        db.session.bulk_insert_mappings(Products, [
+            {"user_id": "large", "product_id": str(i), "name": "Pen",
+             "quantity": 1, "price": i, "time": date(2020, 1, 1)}
+            for i in range(50)
+        ])
+        db.session.commit()
+        self.assertEqual(self._count_statements(large.delete), self._count_statements(small.delete))
+        self.assertEqual(Shopcarts.all(), [])
+        self.assertEqual(Products.all(), [])
+
+    def test_shopcart_version(self):
+        """It should bump the version of a Shopcart on every change to its products"""
+        shopcart = Shopcarts(user_id="1")
+        shopcart.create()
+        self.assertEqual(Shopcarts.find_version("1").version, 1)
+        self.assertEqual(Shopcarts.find_version("1").id, shopcart.id)
+        product = Products(user_id="1", product_id="1", name="Pen", price=1, time=date(2011, 1, 2), quantity=1)
+        product.create()
+        self.assertEqual(Shopcarts.find_version("1").version, 2)
+        product.quantity = 2
+        product.update()
+        self.assertEqual(Shopcarts.find_version("1").version, 3)
+        shopcart.replace_products([Products(user_id="1", product_id="2", name="Ink", price=1,
+                                            time=date(2011, 1, 2), quantity=1)])
+        self.assertEqual(Shopcarts.find_version("1").version, 4)
+        Products.find_by_user_id_product_id("1", "2").first().delete()
+        self.assertEqual(Shopcarts.find_version("1").version, 5)
+        shopcart.empty()
+        self.assertEqual(Shopcarts.find_version("1").version, 6)
+        self.assertIsNone(Shopcarts.find_version("2"))
+
+    def test_shopcart_totals(self):
+        """It should keep the totals of a Shopcart up to date on every change to its products"""
+        def totals(user_id):
+            return tuple(Shopcarts.find_totals(user_id))
+
+        shopcart = Shopcarts(user_id="1")
+        shopcart.create()
+        Shopcarts(user_id="2").create()
+        self.assertEqual(totals("1"), (0, 0, 0))
+        pen = Products(user_id="1", product_id="1", name="Pen", price=2, quantity=3)
+        pen.create()
+        Products(user_id="1", product_id="2", name="Ink", price=1.5, quantity=2).create()
+        self.assertEqual(totals("1"), (2, 5, 9))
+        # adding an existing product replaces it
+        Products(user_id="1", product_id="2", name="Ink", price=1.5, quantity=4).create()
+        self.assertEqual(totals("1"), (2, 7, 12))
+        pen.quantity = 1
+        pen.update()
+        self.assertEqual(totals("1"), (2, 5, 8))
+        pen.user_id = "2"
+        pen.update()
+        self.assertEqual(totals("1"), (1, 4, 6))
+        self.assertEqual(totals("2"), (1, 1, 2))
+        pen.delete()
+        self.assertEqual(totals("2"), (0, 0, 0))
+        shopcart.replace_products([
+            Products(user_id="1", product_id="3", name="Pad", price=4, quantity=1),
+            Products(user_id="1", product_id="4", name="Cap", price=1, quantity=2),
+        ])
+        self.assertEqual(totals("1"), (2, 3, 6))
+        shopcart.empty()
+        self.assertEqual(totals("1"), (0, 0, 0))
+
+    def test_reconcile_shopcart_totals(self):
+        """It should repair the Shopcart totals that drifted from the products"""
+        Shopcarts(user_id="1").create()
+        Shopcarts(user_id="2").create()
+        Products(user_id="1", product_id="1", name="Pen", price=2, quantity=3).create()
+        db.session.bulk_insert_mappings(Products, [
+            {"user_id": "2", "product_id": "1", "name": "Pen", "quantity": 2, "price": 5, "time": date(2020, 1, 1)}
+        ])
+        db.session.commit()
+        version = Shopcarts.find_version("2").version
+        self.assertEqual(tuple(Shopcarts.find_totals("2")), (0, 0, 0))
+        self.assertEqual(Shopcarts.reconcile(), 1)
+        self.assertEqual(tuple(Shopcarts.find_totals("1")), (1, 3, 6))
+        self.assertEqual(tuple(Shopcarts.find_totals("2")), (1, 2, 10))
+        self.assertEqual(Shopcarts.find_version("2").version, version + 1)
+        self.assertEqual(Shopcarts.reconcile(), 0)
+
+    def test_reconcile_float_totals(self):
+        """It should not repair totals that only differ by the float rounding"""
+        Shopcarts(user_id="1").create()
+        for product_id, price in (("1", 0.1), ("2", 0.2), ("3", 0.3)):
+            Products(user_id="1", product_id=product_id, name="Pen", price=price, quantity=1).create()
+        Shopcarts.query.filter_by(user_id="1").update({Shopcarts.subtotal: 0.6})
+        db.session.commit()
+        version = Shopcarts.find_version("1").version
+        self.assertEqual(Shopcarts.reconcile(), 0)
+        self.assertEqual(Shopcarts.find_version("1").version, version)
+        Shopcarts.query.filter_by(user_id="1").update({Shopcarts.subtotal: 0.59})
+        db.session.commit()
+        self.assertEqual(Shopcarts.reconcile(), 1)
+
+        # the total quantity is added up one product at a time too
+        Shopcarts(user_id="2").create()
+        for product_id, quantity in (("1", 0.1), ("2", 0.2), ("3", 0.7)):
+            Products(user_id="2", product_id=product_id, name="Pen", price=1, quantity=quantity).create()
+        Products.find_by_user_id_product_id("2", "1").first().delete()
+        version = Shopcarts.find_version("2").version
+        self.assertEqual(Shopcarts.reconcile(), 0)
+        self.assertEqual(Shopcarts.find_version("2").version, version)
+        Shopcarts.query.filter_by(user_id="2").update({Shopcarts.total_quantity: 0.8})
+        db.session.commit()
+        self.assertEqual(Shopcarts.reconcile(), 1)
+
+    def test_update_product_version_conflict(self):
+        """It should not update a Product when its Shopcart is not at the expected version"""
+        shopcart = Shopcarts(user_id="1")
+        shopcart.create()
+        product = Products(user_id="1", product_id="1", name="Pen", price=1, time=date(2011, 1, 2), quantity=1)
+        product.create()
+        current = Shopcarts.find_version("1")
+        product.quantity = 2
+        product.update([(current.id, current.version)])
+        product.quantity = 3
+        self.assertRaises(VersionConflictError, product.update, [(current.id, current.version)])
+        self.assertEqual(Products.find(product.id).quantity, 2)
+        self.assertEqual(Shopcarts.find_version("1").version, current.version + 1)
+        self.assertRaises(VersionConflictError, shopcart.replace_products, [], [(current.id, current.version)])
+        self.assertEqual(len(Products.all()), 1)
+
     def test_serialize_a_shopcart(self):
         """It should serialize a Shopcart"""
         shopcart = ShopcartsFactory()
@@ -553,6 +786,78 @@ class TestShopcartsModel(unittest.TestCase):
         self.assertEqual(shopcarts[0].id, original_id)
         self.assertEqual(shopcarts[0].products, new_products)
 
+    def test_replace_products(self):
+        """It should replace the Products of a Shopcart with one commit"""
+        shopcart = Shopcarts(user_id="1")
+        shopcart.create()
+        for product_id in ("1", "2", "3"):
+            Products(user_id="1", product_id=product_id, name="Pen",
+                     price=1, time=date(2011, 1, 2), quantity=1).create()
+        kept = Products(user_id="1", product_id="1", name="Pen", price=1, time=date(2011, 1, 2), quantity=1)
+        changed = Products(user_id="1", product_id="2", name="Pen", price=5, time=date(2011, 1, 2), quantity=3)
+        added = Products(user_id="1", product_id="4", name="Ink", price=2, time=date(2011, 1, 3), quantity=1)
+        kept_id = Products.find_by_user_id_product_id("1", "1").first().id
+        commits = []
+
+        def count(_session):
+            commits.append(1)
+
+        event.listen(db.session, "after_commit", count)
+        try:
+            shopcart.replace_products([kept, changed, added])
+        finally:
+            event.remove(db.session, "after_commit", count)
+        self.assertEqual(len(commits), 1)
+        products = {product.product_id: product for product in Products.find_by_user_id("1")}
+        self.assertEqual(sorted(products), ["1", "2", "4"])
+        self.assertEqual(products["1"].id, kept_id)
+        self.assertEqual(products["2"].price, 5)
+        self.assertEqual(products["2"].quantity, 3)
+        self.assertEqual(products["4"].name, "Ink")
+        self.assertEqual(len(shopcart.products), 3)
+
+    def test_replace_products_unchanged(self):
+        """It should only bump the version when replacing Products with the same ones"""
+        shopcart = Shopcarts(user_id="1")
+        shopcart.create()
+        product = Products(user_id="1", product_id="1", name="Pen", price=1, time=date(2011, 1, 2), quantity=1)
+        product.create()
+        statements = []
+
+        def record(_conn, _cursor, statement, *_args):
+            statements.append(statement)
+
+        same = Products(user_id="1", product_id="1", name="Pen", price=1, time=date(2011, 1, 2), quantity=1)
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            shopcart.replace_products([same])
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+        writes = [statement for statement in statements if not statement.lstrip().upper().startswith("SELECT")]
+        self.assertEqual(len(writes), 1)
+        self.assertTrue(writes[0].lstrip().upper().startswith("UPDATE SHOPCARTS"))
+
+    def test_replace_products_locks_first(self):
+        """It should lock the Shopcart before reading the Products it replaces"""
+        shopcart = Shopcarts(user_id="1")
+        shopcart.create()
+        Products(user_id="1", product_id="1", name="Pen", price=1, time=date(2011, 1, 2), quantity=1).create()
+        statements = []
+
+        def record(_conn, _cursor, statement, *_args):
+            statements.append(" ".join(statement.split()).upper())
+
+        added = Products(user_id="1", product_id="2", name="Ink", price=2, time=date(2011, 1, 3), quantity=1)
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            shopcart.replace_products([added])
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+        touch = next(i for i, statement in enumerate(statements) if statement.startswith("UPDATE SHOPCARTS"))
+        read = next(i for i, statement in enumerate(statements)
+                    if statement.startswith("SELECT") and "FROM PRODUCTS" in statement)
+        self.assertLess(touch, read)
+
     def test_update_shopcart_no_id(self):
         """It should not Update a Shopcart with no id"""
         shopcart = ShopcartsFactory()
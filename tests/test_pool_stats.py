@@ -0,0 +1,51 @@
+"""
+Test cases for the Connection Pool Statistics
+"""
+from unittest import TestCase
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from service.common.pool_stats import TimedQueuePool, init_pool_stats, pool_stats
+
+
+class TestPoolStats(TestCase):
+    """Test Cases for the timed connection pool"""
+
+    def setUp(self):
+        pool_stats.reset()
+        self.engine = create_engine("sqlite://", poolclass=TimedQueuePool,
+                                    pool_size=1, max_overflow=0, pool_timeout=0.01)
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_checkouts(self):
+        """It should count checkouts, connects and the time spent waiting"""
+        for _ in range(3):
+            with self.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+        stats = pool_stats.snapshot()
+        self.assertEqual(stats["checkouts"], 3)
+        self.assertEqual(stats["connects"], 1)
+        self.assertGreaterEqual(stats["wait_seconds_total"], stats["wait_seconds_max"])
+        self.assertIn({"size": 1, "checked_in": 1, "checked_out": 0, "overflow": 0}, stats["pools"])
+
+    def test_timeouts(self):
+        """It should count checkouts that timed out waiting for a connection"""
+        with self.engine.connect():
+            self.assertRaises(PoolTimeoutError, self.engine.connect)
+        self.assertEqual(pool_stats.snapshot()["timeouts"], 1)
+
+    def test_invalidations(self):
+        """It should count invalidated connections"""
+        with self.engine.connect() as connection:
+            connection.invalidate()
+        self.assertEqual(pool_stats.snapshot()["invalidations"], 1)
+
+    def test_init_pool_stats(self):
+        """It should only use the timed pool for queue pool configurations"""
+        app = type("App", (), {"config": {"SQLALCHEMY_ENGINE_OPTIONS": {"pool_size": 5}}})
+        init_pool_stats(app)
+        self.assertIs(app.config["SQLALCHEMY_ENGINE_OPTIONS"]["poolclass"], TimedQueuePool)
+        app = type("App", (), {"config": {}})
+        init_pool_stats(app)
+        self.assertNotIn("poolclass", app.config["SQLALCHEMY_ENGINE_OPTIONS"])
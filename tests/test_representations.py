@@ -0,0 +1,43 @@
+"""
+Test cases for the JSON Representation
+"""
+import json
+from datetime import date
+from unittest import TestCase
+from unittest.mock import patch
+from service import app
+from service.common import representations
+
+
+class TestRepresentations(TestCase):
+    """Test Cases for the application/json representation"""
+
+    def setUp(self):
+        self.data = {"id": 1, "user_id": "foo", "price": 2.0, "time": date(2020, 12, 12).isoformat(),
+                     "products": [{"quantity": 1.5}]}
+
+    def test_output_json(self):
+        """It should encode the body like the standard library"""
+        with app.test_request_context():
+            resp = representations.output_json(self.data, 201, {"ETag": '"1-1"'})
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.headers["ETag"], '"1-1"')
+        self.assertTrue(resp.get_data(as_text=True).endswith("\n"))
+        self.assertEqual(json.loads(resp.get_data()), self.data)
+
+    def test_output_json_without_orjson(self):
+        """It should fall back to the flask-restx encoder when orjson is missing"""
+        with app.test_request_context():
+            fast = representations.output_json(self.data, 200)
+            with patch.object(representations, "orjson", None):
+                slow = representations.output_json(self.data, 200)
+        self.assertEqual(json.loads(slow.get_data()), json.loads(fast.get_data()))
+
+    def test_json_line(self):
+        """It should encode a record as one line of JSON with or without orjson"""
+        fast = representations.json_line(self.data)
+        with patch.object(representations, "orjson", None):
+            slow = representations.json_line(self.data)
+        for line in (fast, slow):
+            self.assertEqual(line[-1:], b"\n" if isinstance(line, bytes) else "\n")
+            self.assertEqual(json.loads(line), self.data)
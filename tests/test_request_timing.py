@@ -0,0 +1,77 @@
+"""
+Test cases for the Request Timing
+"""
+import logging
+from unittest import TestCase
+from flask import Flask, jsonify
+from sqlalchemy import create_engine, text
+from service.common import request_timing
+from service.common.request_timing import QueryBudgetExceeded, query_budget
+
+
+def make_app(engine):
+    """Creates an app whose views run two statements"""
+    app = Flask(__name__)
+
+    @app.route("/queries")
+    def queries():
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+            connection.execute(text("SELECT 2"))
+        return jsonify(status="OK")
+
+    @app.route("/budget")
+    @query_budget(1)
+    def over_budget():
+        return queries()
+
+    @app.route("/static")
+    def no_queries():
+        return jsonify(status="OK")
+
+    request_timing.init_request_timing(app)
+    return app
+
+
+class TestRequestTiming(TestCase):
+    """Test Cases for the per request SQL statistics"""
+
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        self.app = make_app(self.engine)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_server_timing(self):
+        """It should send the statements and their time in Server-Timing"""
+        resp = self.client.get("/queries")
+        self.assertEqual(resp.status_code, 200)
+        timing = resp.headers["Server-Timing"]
+        self.assertRegex(timing, r'^db;dur=\d+\.\d;desc="2 queries", app;dur=\d+\.\d$')
+        resp = self.client.get("/static")
+        self.assertIn('desc="0 queries"', resp.headers["Server-Timing"])
+
+    def test_access_log(self):
+        """It should log the statements of every request"""
+        self.app.logger.setLevel(logging.INFO)
+        with self.assertLogs(self.app.logger, logging.INFO) as logs:
+            self.client.get("/queries?x=1")
+        self.assertRegex(logs.output[-1], r"GET /queries\?x=1 200 2 queries db=\d+\.\dms total=\d+\.\dms")
+
+    def test_query_budget_warning(self):
+        """It should warn about a request over its query budget"""
+        with self.assertLogs(self.app.logger, logging.WARNING) as logs:
+            resp = self.client.get("/budget")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("GET /budget issued 2 queries, its budget is 1", logs.output[-1])
+
+    def test_query_budget_strict(self):
+        """It should fail a request over its query budget when testing"""
+        self.app.testing = True
+        self.assertRaises(QueryBudgetExceeded, self.client.get, "/budget")
+        self.app.testing = False
+        self.app.config["QUERY_BUDGET_STRICT"] = True
+        resp = self.client.get("/budget")
+        self.assertEqual(resp.status_code, 500)
@@ -6,10 +6,13 @@ Test cases can be run with the following:
   coverage report -m
 """
 import os
+import json
 import logging
+import tempfile
 from datetime import date
 from unittest import TestCase
 # from unittest.mock import MagicMock, patch
+from sqlalchemy import event
 from service import app, routes
 from service.models import db, Products, Shopcarts, DataValidationError, init_db
 from service.common import status  # HTTP Status Codes
@@ -22,6 +25,7 @@ DATABASE_URI = os.getenv(
 )
 BASE_URL_API = "/api/shopcarts"
 CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_NDJSON = "application/x-ndjson"
 
 ######################################################################
 #  T E S T   C A S E S
@@ -63,6 +67,7 @@ class TestYourResourceServer(TestCase):
         db.session.query(Products).delete()  # clean up the last tests
         db.session.query(Shopcarts).delete()  # clean up the last tests
         db.session.commit()
+        routes.cart_cache.clear()
 
     def tearDown(self):
         """ This runs after each test """
@@ -109,6 +114,20 @@ class TestYourResourceServer(TestCase):
             products.append(test_product)
         return products
 
+    def _count_queries(self, url, headers=None, method="get", **kwargs):
+        """Returns the response for url and the number of SQL statements it issued"""
+        statements = []
+
+        def count(*_args):
+            statements.append(1)
+
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            response = getattr(self.app, method)(url, headers=headers, **kwargs)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+        return response, len(statements)
+
     ######################################################################
     #  P L A C E   T E S T   C A S E S   H E R E
     ######################################################################
@@ -118,6 +137,15 @@ class TestYourResourceServer(TestCase):
         resp = self.app.get("/")
         self.assertEqual(resp.status_code, status.HTTP_200_OK)
 
+    def test_pool_stats(self):
+        """ It should return the connection pool statistics """
+        resp = self.app.get("/health/pool")
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertIn("checkouts", data)
+        self.assertIn("wait_seconds_max", data)
+        self.assertIsInstance(data["pools"], list)
+
     def test_create_shopcarts(self):
         """ It should Create a Shopcart """
         shopcart = ShopcartsFactory()
@@ -243,6 +271,143 @@ class TestYourResourceServer(TestCase):
         data = response.get_json()
         self.assertEqual(len(data), 5)
 
+    def test_get_shopcart_list_constant_queries(self):
+        """It should List Shopcarts with a constant number of queries"""
+        shopcarts = self._create_shopcarts(8)
+        for shopcart in shopcarts[:2]:
+            self._create_products(3, shopcart.user_id)
+        response, few_carts = self._count_queries(f"{BASE_URL_API}?user-id={shopcarts[0].user_id}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response, all_carts = self._count_queries(BASE_URL_API)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(all_carts, few_carts)
+        for shopcart in shopcarts[2:]:
+            self._create_products(3, shopcart.user_id)
+        response, many_products = self._count_queries(BASE_URL_API)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.get_json()
+        self.assertEqual(len(data), 8)
+        self.assertEqual(many_products, all_carts)
+        for shopcart in data:
+            self.assertEqual(len(shopcart["products"]), 3)
+
+    def test_get_many_shopcarts(self):
+        """It should Get the Shopcarts of many users keyed by user_id with a constant number of queries"""
+        shopcarts = self._create_shopcarts(6)
+        for shopcart in shopcarts:
+            self._create_products(2, shopcart.user_id)
+        response, two_carts = self._count_queries(f"{BASE_URL_API}?user-id=0,1")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.get_json()), {"0", "1"})
+        response, more_carts = self._count_queries(f"{BASE_URL_API}?user-id=0,1,2&user-id=3&user-id=4,5,missing")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(more_carts, two_carts)
+        data = response.get_json()
+        self.assertEqual(list(data), ["0", "1", "2", "3", "4", "5", "missing"])
+        self.assertIsNone(data["missing"])
+        self.assertEqual(data["3"]["user_id"], "3")
+        self.assertEqual(len(data["3"]["products"]), 2)
+
+    def test_get_many_shopcarts_same_user(self):
+        """It should Get the Shopcarts keyed by user_id whenever user-id is repeated or comma separated"""
+        self._create_shopcarts(1)
+        for query in ("user-id=0,0", "user-id=0&user-id=0", "user-id=0,", "user-id=missing,missing"):
+            response = self.app.get(f"{BASE_URL_API}?{query}")
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIsInstance(response.get_json(), dict, query)
+        self.assertEqual(list(self.app.get(f"{BASE_URL_API}?user-id=0,0").get_json()), ["0"])
+        response = self.app.get(f"{BASE_URL_API}?user-id=0")
+        self.assertIsInstance(response.get_json(), list)
+
+    def test_get_too_many_shopcarts(self):
+        """It should not Get the Shopcarts of more users than allowed"""
+        user_ids = ",".join(str(i) for i in range(app.config["SHOPCARTS_MAX_USER_IDS"] + 1))
+        response = self.app.get(f"{BASE_URL_API}?user-id={user_ids}")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_shopcart_list_fast_path(self):
+        """It should send the same Shopcarts whether or not the body is marshalled"""
+        shopcarts = self._create_shopcarts(3)
+        self._create_products(2, shopcarts[0].user_id)
+        response = self.app.get(BASE_URL_API)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.content_type, CONTENT_TYPE_JSON)
+        expected = [routes.api.marshal(shopcart.serialize(), routes.id_shopcart_model)
+                    for shopcart in Shopcarts.page_with_products(None, 3)]
+        self.assertEqual(response.get_json(), json.loads(json.dumps(expected)))
+        # a field mask is still applied by the marshaller
+        response = self.app.get(BASE_URL_API, headers={"X-Fields": "user_id,item_count"})
+        self.assertEqual(response.get_json()[0], {"user_id": "0", "item_count": 2})
+
+    def test_get_shopcart_list_paginated(self):
+        """It should page through the Shopcarts with a cursor"""
+        shopcarts = self._create_shopcarts(5)
+        seen = []
+        url = f"{BASE_URL_API}?limit=2"
+        while url:
+            response = self.app.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            data = response.get_json()
+            self.assertLessEqual(len(data), 2)
+            seen.extend(shopcart["user_id"] for shopcart in data)
+            url = None
+            if "Link" in response.headers:
+                cursor = response.headers["X-Next-Cursor"]
+                self.assertIn(f"cursor={cursor}", response.headers["Link"])
+                url = f"{BASE_URL_API}?limit=2&cursor={cursor}"
+        self.assertEqual(seen, [shopcart.user_id for shopcart in shopcarts])
+
+    def test_get_shopcart_list_max_page_size(self):
+        """It should cap the page size at the configured maximum"""
+        self._create_shopcarts(3)
+        max_page_size = app.config["SHOPCARTS_MAX_PAGE_SIZE"]
+        app.config["SHOPCARTS_MAX_PAGE_SIZE"] = 2
+        try:
+            response = self.app.get(f"{BASE_URL_API}?limit=1000")
+        finally:
+            app.config["SHOPCARTS_MAX_PAGE_SIZE"] = max_page_size
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.get_json()), 2)
+        self.assertIn('rel="next"', response.headers["Link"])
+
+    def test_get_shopcart_list_bad_page_args(self):
+        """It should not List Shopcarts with a bad limit or cursor"""
+        response = self.app.get(f"{BASE_URL_API}?limit=0")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.app.get(f"{BASE_URL_API}?limit=abc")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.app.get(f"{BASE_URL_API}?cursor=not-a-cursor")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_stream_shopcart_list(self):
+        """It should stream every Shopcart as newline delimited JSON"""
+        shopcarts = self._create_shopcarts(3)
+        self._create_products(2, shopcarts[0].user_id)
+        response = self.app.get(f"{BASE_URL_API}?limit=1", headers={"Accept": CONTENT_TYPE_NDJSON})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.mimetype, CONTENT_TYPE_NDJSON)
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([line["user_id"] for line in lines], [shopcart.user_id for shopcart in shopcarts])
+        self.assertEqual(len(lines[0]["products"]), 2)
+        self.assertEqual(lines[1]["products"], [])
+        # the JSON and the NDJSON responses of the URL must be cached apart
+        self.assertIn("Accept", response.vary)
+        response = self.app.get(f"{BASE_URL_API}?limit=1")
+        self.assertEqual(response.mimetype, "application/json")
+        self.assertIn("Accept", response.vary)
+
+    def test_read_shopcart_constant_queries(self):
+        """It should Read a Shopcart with its products in a constant number of queries"""
+        shopcart = self._create_shopcarts(1)[0]
+        self._create_products(1, shopcart.user_id)
+        response, one_product = self._count_queries(f"{BASE_URL_API}/{shopcart.user_id}")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self._create_products(10, shopcart.user_id)
+        response, many_products = self._count_queries(f"{BASE_URL_API}/{shopcart.user_id}")
+        self.assertEqual(len(response.get_json()["products"]), 10)
+        self.assertEqual(many_products, one_product)
+        self.assertIn(f'desc="{many_products} queries"', response.headers["Server-Timing"])
+
     def test_create_products(self):
         """ It should Create a Shopcart and add products to it"""
         shopcart = ShopcartsFactory()
@@ -276,6 +441,117 @@ class TestYourResourceServer(TestCase):
             self.assertEqual(data["product_id"], product.product_id)
             self.assertEqual(data["name"], product.name)
 
+    def test_slow_queries(self):
+        """It should list the slow queries with the model method that issued them"""
+        self.app.post(BASE_URL_API, json={"user_id": TEST_USER}, headers=self.headers)
+        threshold = routes.slow_queries.threshold_ms
+        routes.slow_queries.threshold_ms = 0
+        try:
+            self.app.get(f"{BASE_URL_API}/{TEST_USER}/summary")
+        finally:
+            routes.slow_queries.threshold_ms = threshold
+        resp = self.app.get("/admin/slow-queries", headers=self.headers)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        data = resp.get_json()
+        self.assertEqual(data["threshold_ms"], threshold)
+        self.assertIn("Shopcarts.find_totals", [query["caller"] for query in data["queries"]])
+        self.assertNotIn(TEST_USER, str(data["queries"]))
+        resp = self.app.delete("/admin/slow-queries", headers=self.headers)
+        self.assertEqual(resp.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.app.get("/admin/slow-queries", headers=self.headers).get_json()["queries"], [])
+
+    def test_slow_queries_of_lazy_queries(self):
+        """It should name the model method that built a query that runs after it returned"""
+        self.app.post(BASE_URL_API, json={"user_id": TEST_USER}, headers=self.headers)
+        product = {"user_id": TEST_USER, "product_id": "1", "name": "Pen", "price": 1, "quantity": 1,
+                   "time": "2022-01-01"}
+        self.app.post(f"{BASE_URL_API}/{TEST_USER}/items", json=product, headers=self.headers)
+        routes.slow_queries.clear()
+        threshold = routes.slow_queries.threshold_ms
+        routes.slow_queries.threshold_ms = 0
+        try:
+            self.app.get(f"{BASE_URL_API}/{TEST_USER}/items?order-type=PA")
+            self.app.get(f"{BASE_URL_API}/{TEST_USER}")
+        finally:
+            routes.slow_queries.threshold_ms = threshold
+        callers = [query["caller"] for query in routes.slow_queries.records()]
+        self.assertIn("Products.find_product_with_order", callers)
+        self.assertIn("Shopcarts.find_by_user_id_with_products", callers)
+        self.assertNotIn("Products.serialize_rows", callers)
+        self.assertNotIn("service.routes.load_shopcart", callers)
+
+    def test_slow_queries_require_api_key(self):
+        """It should not serve or clear the slow queries without the API key"""
+        for headers in ({}, {"X-Api-Key": "wrong"}, {"X-Api-Key": ""}):
+            resp = self.app.get("/admin/slow-queries", headers=headers)
+            self.assertEqual(resp.status_code, status.HTTP_401_UNAUTHORIZED)
+            resp = self.app.delete("/admin/slow-queries", headers=headers)
+            self.assertEqual(resp.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_read_shopcart_summary(self):
+        """It should Read the totals of a Shopcart"""
+        self.app.post(BASE_URL_API, json={"user_id": TEST_USER}, headers=self.headers)
+        url = f"{BASE_URL_API}/{TEST_USER}/summary"
+        resp = self.app.get(url)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(resp.get_json(), {"user_id": TEST_USER, "item_count": 0,
+                                           "total_quantity": 0.0, "subtotal": 0.0})
+        for product_id, price, quantity in (("1", 4, 2), ("2", 2.5, 1)):
+            product = {"user_id": TEST_USER, "product_id": product_id, "name": "Pen",
+                       "price": price, "quantity": quantity, "time": "2022-01-01"}
+            self.app.post(f"{BASE_URL_API}/{TEST_USER}/items", json=product, headers=self.headers)
+        resp = self.app.get(url)
+        self.assertEqual(resp.get_json(), {"user_id": TEST_USER, "item_count": 2,
+                                           "total_quantity": 3.0, "subtotal": 10.5})
+        resp = self.app.get(url, headers={"If-None-Match": resp.headers["ETag"]})
+        self.assertEqual(resp.status_code, status.HTTP_304_NOT_MODIFIED)
+        resp = self.app.get(f"{BASE_URL_API}/missing/summary")
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_add_products_batch(self):
+        """It should Add and update many Products in one request"""
+        self.app.post(BASE_URL_API, json={"user_id": TEST_USER}, headers=self.headers)
+        url = f"{BASE_URL_API}/{TEST_USER}/items:batch"
+        first = ProductsFactory(user_id=TEST_USER, product_id="1", price=2, quantity=1).serialize()
+        self.app.post(f"{BASE_URL_API}/{TEST_USER}/items", json=first, headers=self.headers)
+        batch = [
+            dict(first, quantity=3),
+            ProductsFactory(user_id=TEST_USER, product_id="2", price=1, quantity=2).serialize(),
+            ProductsFactory(user_id=TEST_USER, product_id="3", price=4, quantity=1).serialize(),
+        ]
+        resp, count = self._count_queries(url, self.headers, "post", json=batch)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertIn("ETag", resp.headers)
+        data = resp.get_json()
+        self.assertEqual([result["status"] for result in data], ["updated", "created", "created"])
+        self.assertEqual([result["product"]["product_id"] for result in data], ["1", "2", "3"])
+        self.assertEqual(data[0]["product"]["quantity"], 3)
+        summary = self.app.get(f"{BASE_URL_API}/{TEST_USER}/summary").get_json()
+        self.assertEqual((summary["item_count"], summary["total_quantity"], summary["subtotal"]), (3, 6, 12))
+
+        # the statements do not grow with the size of the batch
+        more = batch + [ProductsFactory(user_id=TEST_USER, product_id=str(i)).serialize() for i in range(4, 30)]
+        resp, more_count = self._count_queries(url, self.headers, "post", json=more)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertEqual(more_count, count)
+        self.assertEqual(len(self.app.get(f"{BASE_URL_API}/{TEST_USER}").get_json()["products"]), 29)
+
+    def test_add_products_batch_not_valid(self):
+        """It should not Add any Product of a batch with an invalid one"""
+        self.app.post(BASE_URL_API, json={"user_id": TEST_USER}, headers=self.headers)
+        url = f"{BASE_URL_API}/{TEST_USER}/items:batch"
+        good = ProductsFactory(user_id=TEST_USER).serialize()
+        batch = [good, dict(good, price=-1), dict(good, user_id="other"), {"name": "Pen"}]
+        resp = self.app.post(url, json=batch, headers=self.headers)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([error["index"] for error in resp.get_json()["errors"]], [1, 2, 3])
+        self.assertEqual(self.app.get(f"{BASE_URL_API}/{TEST_USER}").get_json()["products"], [])
+        resp = self.app.post(url, json=good, headers=self.headers)
+        self.assertEqual(resp.status_code, status.HTTP_400_BAD_REQUEST)
+        resp = self.app.post(f"{BASE_URL_API}/missing/items:batch",
+                             json=[dict(good, user_id="missing")], headers=self.headers)
+        self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_get_product_not_found(self):
         """It should not Get a Product thats not found"""
         shopcart = ShopcartsFactory()
@@ -300,6 +576,24 @@ class TestYourResourceServer(TestCase):
         data = resp.get_json()
         self.assertEqual(len(data), 5)
 
+    def test_stream_products(self):
+        """It should stream the Products of a Shopcart as newline delimited JSON"""
+        shopcart = self._create_shopcarts(1)[0]
+        products = self._create_products(4, shopcart.user_id)
+        response = self.app.get(f"{BASE_URL_API}/{shopcart.user_id}/items?order-type=PA",
+                                headers={"Accept": CONTENT_TYPE_NDJSON})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.mimetype, CONTENT_TYPE_NDJSON)
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual(len(lines), len(products))
+        for i in range(len(lines) - 1):
+            self.assertTrue(lines[i]["price"] <= lines[i+1]["price"])
+        self.assertIn("Accept", response.vary)
+        response = self.app.get(f"{BASE_URL_API}/{shopcart.user_id}/items")
+        self.assertIn("Accept", response.vary)
+        self.assertEqual(sorted(lines, key=lambda line: line["id"]),
+                         sorted(response.get_json(), key=lambda line: line["id"]))
+
     def test_update_a_product(self):
         """ It should Update a Product """
         shopcart = ShopcartsFactory()
@@ -432,6 +726,237 @@ class TestYourResourceServer(TestCase):
         data = resp.get_json()
         self.assertEqual(data["products"], [])
 
+    def test_read_shopcart_cached(self):
+        """ It should serve repeated Shopcart reads from the cache until a write """
+        shopcart = self._create_shopcarts(1)[0]
+        self._create_products(2, shopcart.user_id)
+        url = f"{BASE_URL_API}/{shopcart.user_id}"
+        before = self.app.get("/health/cache").get_json()
+        response, first_read = self._count_queries(url)
+        self.assertEqual(len(response.get_json()["products"]), 2)
+        self.assertGreater(first_read, 0)
+        response, second_read = self._count_queries(url)
+        self.assertEqual(len(response.get_json()["products"]), 2)
+        self.assertEqual(second_read, 0)
+        response, _ = self._count_queries(f"{url}/items")
+        response, cached_items = self._count_queries(f"{url}/items")
+        self.assertEqual(len(response.get_json()), 2)
+        self.assertEqual(cached_items, 0)
+        stats = self.app.get("/health/cache").get_json()
+        self.assertEqual(stats["hits"] - before["hits"], 2)
+        self.assertEqual(stats["misses"] - before["misses"], 2)
+
+        # every write path invalidates the cart
+        self._create_products(3, shopcart.user_id)
+        self.assertEqual(len(self.app.get(url).get_json()["products"]), 3)
+        self.assertEqual(len(self.app.get(f"{url}/items").get_json()), 3)
+        self.app.delete(f"{url}/items/0", headers=self.headers)
+        self.assertEqual(len(self.app.get(url).get_json()["products"]), 2)
+        self.app.put(url, json=self._make_products(1, shopcart.user_id), headers=self.headers)
+        self.assertEqual(len(self.app.get(f"{url}/items").get_json()), 1)
+        product = self._make_products(1, shopcart.user_id)[0]
+        product["name"] = "Renamed"
+        self.app.put(f"{url}/items/0", json=product, headers=self.headers)
+        self.assertEqual(self.app.get(url).get_json()["products"][0]["name"], "Renamed")
+        self.app.put(f"{url}/empty")
+        self.assertEqual(self.app.get(url).get_json()["products"], [])
+        self.app.delete(url, headers=self.headers)
+        self.assertEqual(self.app.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_read_products_cached_per_query(self):
+        """ It should cache the item listing separately for each query """
+        shopcart = self._create_shopcarts(1)[0]
+        self.app.post(f"{BASE_URL_API}/{shopcart.user_id}/items", headers=self.headers,
+                      json=Products(user_id=shopcart.user_id, product_id="1", name="Pen",
+                                    price=4, time=date(2011, 1, 2), quantity=1).serialize())
+        self.app.post(f"{BASE_URL_API}/{shopcart.user_id}/items", headers=self.headers,
+                      json=Products(user_id=shopcart.user_id, product_id="2", name="Pencil",
+                                    price=2, time=date(2011, 1, 2), quantity=1).serialize())
+        url = f"{BASE_URL_API}/{shopcart.user_id}/items"
+        self.assertEqual(len(self.app.get(url).get_json()), 2)
+        self.assertEqual(len(self.app.get(f"{url}?max-price=3&min-price=1").get_json()), 1)
+        prices = [product["price"] for product in self.app.get(f"{url}?order-type=PD").get_json()]
+        self.assertEqual(prices, [4, 2])
+        prices = [product["price"] for product in self.app.get(f"{url}?order-type=PA").get_json()]
+        self.assertEqual(prices, [2, 4])
+
+    def test_read_shopcart_not_modified(self):
+        """ It should answer a conditional Shopcart read with 304 until it changes """
+        shopcart = self._create_shopcarts(1)[0]
+        self._create_products(2, shopcart.user_id)
+        for url in (f"{BASE_URL_API}/{shopcart.user_id}", f"{BASE_URL_API}/{shopcart.user_id}/items"):
+            response = self.app.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            etag = response.headers["ETag"]
+            response = self.app.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response.headers["ETag"], etag)
+            self.assertEqual(response.data, b"")
+            # without the cache only the version is looked up
+            routes.cart_cache.clear()
+            response, queries = self._count_queries(url, headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(queries, 1)
+
+        etag = self.app.get(f"{BASE_URL_API}/{shopcart.user_id}").headers["ETag"]
+        self._create_products(3, shopcart.user_id)
+        response = self.app.get(f"{BASE_URL_API}/{shopcart.user_id}", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.headers["ETag"], etag)
+        self.assertEqual(len(response.get_json()["products"]), 3)
+
+    def test_compressed_shopcart_etag(self):
+        """ It should tag a compressed Shopcart apart and accept the tag back in conditional requests """
+        shopcart = self._create_shopcarts(1)[0]
+        self._create_products(20, shopcart.user_id)
+        url = f"{BASE_URL_API}/{shopcart.user_id}"
+        identity = self.app.get(url).headers["ETag"]
+        response = self.app.get(url, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        etag = response.headers["ETag"]
+        self.assertEqual(etag, identity[:-1] + '-gzip"')
+        response = self.app.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.headers["ETag"], etag)
+        routes.cart_cache.clear()
+        response = self.app.get(url, headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        # the writes take the tag of either coding
+        product = self.app.get(f"{url}/items/0").get_json()
+        product["quantity"] = 3.0
+        resp = self.app.put(f"{url}/items/0", json=product, headers=dict(self.headers, **{"If-Match": etag}))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.put(f"{url}/items/0", json=product, headers=dict(self.headers, **{"If-Match": etag}))
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_read_shopcart_etag_changes_on_every_write(self):
+        """ It should change the ETag of a Shopcart on every write """
+        shopcart = self._create_shopcarts(1)[0]
+        url = f"{BASE_URL_API}/{shopcart.user_id}"
+        etags = [self.app.get(url).headers["ETag"]]
+        product = self._make_products(1, shopcart.user_id)[0]
+        self.app.post(f"{url}/items", json=product, headers=self.headers)
+        etags.append(self.app.get(url).headers["ETag"])
+        product["quantity"] = 5.0
+        self.app.put(f"{url}/items/{product['product_id']}", json=product, headers=self.headers)
+        etags.append(self.app.get(url).headers["ETag"])
+        self.app.put(url, json=self._make_products(2, shopcart.user_id), headers=self.headers)
+        etags.append(self.app.get(url).headers["ETag"])
+        self.app.delete(f"{url}/items/0", headers=self.headers)
+        etags.append(self.app.get(url).headers["ETag"])
+        self.app.put(f"{url}/empty")
+        etags.append(self.app.get(url).headers["ETag"])
+        self.assertEqual(len(set(etags)), len(etags))
+
+    def test_update_shopcart_if_match(self):
+        """ It should only replace a Shopcart that is at the If-Match version """
+        shopcart = self._create_shopcarts(1)[0]
+        url = f"{BASE_URL_API}/{shopcart.user_id}"
+        etag = self.app.get(url).headers["ETag"]
+        headers = dict(self.headers, **{"If-Match": etag})
+        resp = self.app.put(url, json=self._make_products(2, shopcart.user_id), headers=headers)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        new_etag = resp.headers["ETag"]
+        self.assertNotEqual(new_etag, etag)
+        self.assertEqual(self.app.get(url).headers["ETag"], new_etag)
+        # a writer still holding the old ETag lost the race
+        resp = self.app.put(url, json=self._make_products(5, shopcart.user_id), headers=headers)
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(len(self.app.get(f"{url}/items").get_json()), 2)
+        self.assertEqual(self.app.get(url).headers["ETag"], new_etag)
+        # If-Match: * and no If-Match at all are unconditional
+        resp = self.app.put(url, json=self._make_products(3, shopcart.user_id),
+                            headers=dict(self.headers, **{"If-Match": "*"}))
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        resp = self.app.put(url, json=self._make_products(4, shopcart.user_id), headers=self.headers)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+
+    def test_update_a_product_if_match(self):
+        """ It should only update a Product in a Shopcart that is at the If-Match version """
+        shopcart = self._create_shopcarts(1)[0]
+        product = self._make_products(1, shopcart.user_id)[0]
+        url = f"{BASE_URL_API}/{shopcart.user_id}"
+        self.app.post(f"{url}/items", json=product, headers=self.headers)
+        etag = self.app.get(url).headers["ETag"]
+        headers = dict(self.headers, **{"If-Match": etag})
+        product["quantity"] = 7.0
+        resp = self.app.put(f"{url}/items/0", json=product, headers=headers)
+        self.assertEqual(resp.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(resp.headers["ETag"], etag)
+        product["quantity"] = 9.0
+        resp = self.app.put(f"{url}/items/0", json=product, headers=headers)
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertEqual(self.app.get(f"{url}/items/0").get_json()["quantity"], 7.0)
+        resp = self.app.put(f"{url}/items/0", json=product,
+                            headers=dict(self.headers, **{"If-Match": '"not-an-etag"'}))
+        self.assertEqual(resp.status_code, status.HTTP_412_PRECONDITION_FAILED)
+
+    def test_move_a_product(self):
+        """It should move a Product to another Shopcart within its query budget"""
+        source, target = (shopcart.user_id for shopcart in self._create_shopcarts(2))
+        product = self._make_products(1, source)[0]
+        for conditional in (False, True):
+            self.app.post(f"{BASE_URL_API}/{source}/items", json=product, headers=self.headers)
+            headers = self.headers
+            if conditional:
+                etag = self.app.get(f"{BASE_URL_API}/{source}").headers["ETag"]
+                headers = dict(self.headers, **{"If-Match": etag})
+            resp = self.app.put(f"{BASE_URL_API}/{source}/items/0", json=dict(product, user_id=target),
+                                headers=headers)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(resp.get_json()["user_id"], target)
+            self.assertEqual(self.app.get(f"{BASE_URL_API}/{source}/summary").get_json()["item_count"], 0)
+            self.assertEqual(self.app.get(f"{BASE_URL_API}/{target}/summary").get_json()["item_count"], 1)
+            self.app.delete(f"{BASE_URL_API}/{target}/items/0", headers=self.headers)
+
+    def test_move_a_product_already_in_target(self):
+        """It should not move a Product to a Shopcart that already has its product_id"""
+        source, target = (shopcart.user_id for shopcart in self._create_shopcarts(2))
+        product = self._make_products(1, source)[0]
+        self.app.post(f"{BASE_URL_API}/{source}/items", json=product, headers=self.headers)
+        self.app.post(f"{BASE_URL_API}/{target}/items", json=dict(product, user_id=target), headers=self.headers)
+        etag = self.app.get(f"{BASE_URL_API}/{target}").headers["ETag"]
+        resp = self.app.put(f"{BASE_URL_API}/{source}/items/0", json=dict(product, user_id=target),
+                            headers=self.headers)
+        self.assertEqual(resp.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(resp.get_json()["error"], "Conflict")
+        # nothing was changed
+        for user_id in (source, target):
+            resp = self.app.get(f"{BASE_URL_API}/{user_id}/items/0")
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            self.assertEqual(self.app.get(f"{BASE_URL_API}/{user_id}/summary").get_json()["item_count"], 1)
+        self.assertEqual(self.app.get(f"{BASE_URL_API}/{target}").headers["ETag"], etag)
+
+    def test_get_reads_from_replica(self):
+        """It should serve GET requests from a read replica and writes from the primary"""
+        replica_dir = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.addCleanup(replica_dir.cleanup)
+        replica_path = os.path.join(replica_dir.name, "replica.db")
+        engine_options = app.config["SQLALCHEMY_ENGINE_OPTIONS"]
+        app.config["SQLALCHEMY_BINDS"] = {"replica_0": f"sqlite:///{replica_path}"}
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {}
+        db.session.remove()
+        replica = db.get_engine(app, bind="replica_0")
+        app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options
+        try:
+            db.metadata.create_all(bind=replica)
+            replica.execute(Shopcarts.__table__.insert(), user_id="on-replica", version=1)
+            self.app.post(BASE_URL_API, json={"user_id": "on-primary"}, headers=self.headers)
+
+            resp = self.app.get(f"{BASE_URL_API}/on-replica", headers=self.headers)
+            self.assertEqual(resp.status_code, status.HTTP_200_OK)
+            resp = self.app.get(f"{BASE_URL_API}/on-primary", headers=self.headers)
+            self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+
+            # the write path only looks at the primary
+            product = ProductsFactory(user_id="on-replica").serialize()
+            resp = self.app.post(f"{BASE_URL_API}/on-replica/items", json=product, headers=self.headers)
+            self.assertEqual(resp.status_code, status.HTTP_404_NOT_FOUND)
+        finally:
+            app.config["SQLALCHEMY_BINDS"] = {}
+            db.session.remove()
+            replica.dispose()
+
     ######################################################################
     #  T E S T   S A D   P A T H S
     ######################################################################
@@ -0,0 +1,132 @@
+"""
+Test cases for the Slow Query Log
+"""
+from unittest import TestCase
+from unittest.mock import MagicMock, call
+from sqlalchemy import create_engine, text
+from service.common import slow_queries, sql_timing
+from service.common.slow_queries import SlowQueryLog
+
+
+class DbapiError(Exception):
+    """Error of the fake PostgreSQL driver"""
+
+
+class TestSlowQueryLog(TestCase):
+    """Test Cases for the recording of slow statements"""
+
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+        with self.engine.begin() as connection:
+            connection.execute(text("CREATE TABLE products (id INTEGER PRIMARY KEY, name VARCHAR)"))
+        self.log = SlowQueryLog(0, 2, with_plans=True)
+        sql_timing.add_observer(self.log.observe)
+
+    def tearDown(self):
+        sql_timing.remove_observer(self.log.observe)
+        self.engine.dispose()
+
+    def run_queries(self, *names):
+        """Selects the products with each name"""
+        with self.engine.connect() as connection:
+            for name in names:
+                connection.execute(text("SELECT id FROM products WHERE name = :name"), {"name": name})
+
+    def test_record_slow_query(self):
+        """It should record a slow statement with its redacted parameters and plan"""
+        self.run_queries("secret")
+        records = self.log.records()
+        self.assertEqual(len(records), 1)
+        record = records[0]
+        self.assertEqual(record["statement"], "SELECT id FROM products WHERE name = ?")
+        self.assertEqual(record["parameters"], ["<str>"])
+        self.assertNotIn("secret", str(record))
+        self.assertIn("SCAN", record["plan"])
+        self.assertGreaterEqual(record["duration_ms"], 0)
+
+    def test_caller_option(self):
+        """It should take the caller of a statement from its caller execution option"""
+        with self.engine.connect() as connection:
+            statement = text("SELECT id FROM products").execution_options(caller="Products.find_by_name")
+            connection.execute(statement)
+        self.assertEqual(self.log.records()[0]["caller"], "Products.find_by_name")
+
+    def test_ring_buffer(self):
+        """It should keep the latest records only"""
+        self.run_queries("a", "b", "c")
+        self.assertEqual(len(self.log.records()), 2)
+        self.log.clear()
+        self.assertEqual(self.log.records(), [])
+
+    def test_threshold(self):
+        """It should not record the statements faster than the threshold"""
+        self.log.threshold_ms = 60000
+        self.run_queries("a")
+        self.assertEqual(self.log.records(), [])
+
+    def test_no_plan_for_writes(self):
+        """It should only explain the SELECT statements"""
+        with self.engine.begin() as connection:
+            connection.execute(text("INSERT INTO products (name) VALUES (:name)"), {"name": "pen"})
+        self.assertIsNone(self.log.records()[0]["plan"])
+
+    def test_redact(self):
+        """It should replace the values of the parameters by their types"""
+        self.assertEqual(
+            slow_queries.redact({"user_id": "u1", "price": 1.5, "time": None}),
+            {"user_id": "<str>", "price": "<float>", "time": None},
+        )
+        self.assertEqual(slow_queries.redact([(1, "a"), (2, "b")]), [["<int>", "<str>"], ["<int>", "<str>"]])
+
+    def test_redact_plan(self):
+        """It should remove the constants from a plan"""
+        plan = ("Index Scan using ix_products_user_id_product_id on products  (cost=0.15..8.17 rows=1 width=4)\n"
+                "  Index Cond: ((user_id)::text = 'o''brien'::text)\n"
+                "  Filter: ((id = 5) AND (price <= '9.5'::double precision) AND (quantity > -2.5))")
+        self.assertEqual(
+            slow_queries.redact_plan(plan),
+            "Index Scan using ix_products_user_id_product_id on products  (cost=0.15..8.17 rows=1 width=4)\n"
+            "  Index Cond: ((user_id)::text = '?'::text)\n"
+            "  Filter: ((id = ?) AND (price <= '?'::double precision) AND (quantity > ?))",
+        )
+
+    @staticmethod
+    def postgres_context(cursor):
+        """Returns the execution context of a fake PostgreSQL driver"""
+        context = MagicMock(executemany=False)
+        context.dialect.name = "postgresql"
+        context.dialect.dbapi.Error = DbapiError
+        context.root_connection.connection.cursor.return_value = cursor
+        return context
+
+    def test_explain_in_savepoint(self):
+        """It should explain in a savepoint and redact the plan"""
+        cursor = MagicMock()
+        cursor.fetchall.return_value = [("Filter: ((user_id)::text = 'u1'::text)",)]
+        context = self.postgres_context(cursor)
+        plan = slow_queries.explain(context, "SELECT id FROM products WHERE user_id = %(user_id)s", {"user_id": "u1"})
+        self.assertEqual(plan, "Filter: ((user_id)::text = '?'::text)")
+        self.assertEqual(cursor.execute.call_args_list, [
+            call("SAVEPOINT slow_query_explain"),
+            call("EXPLAIN SELECT id FROM products WHERE user_id = %(user_id)s", {"user_id": "u1"}),
+            call("RELEASE SAVEPOINT slow_query_explain"),
+        ])
+
+    def test_failed_explain(self):
+        """It should roll a failed EXPLAIN back to its savepoint and log it"""
+        def execute(sql, *_args):
+            if sql.startswith("EXPLAIN"):
+                raise DbapiError("boom")
+
+        cursor = MagicMock()
+        cursor.execute.side_effect = execute
+        logger = MagicMock()
+        plan = slow_queries.explain(self.postgres_context(cursor), "SELECT 1 WHERE 1 = %(value)s", {"value": 1}, logger)
+        self.assertIsNone(plan)
+        self.assertEqual(cursor.execute.call_args_list, [
+            call("SAVEPOINT slow_query_explain"),
+            call("EXPLAIN SELECT 1 WHERE 1 = %(value)s", {"value": 1}),
+            call("ROLLBACK TO SAVEPOINT slow_query_explain"),
+        ])
+        logger.warning.assert_called_once()
+        cursor.close.assert_called_once()